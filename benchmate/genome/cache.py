@@ -0,0 +1,137 @@
+import sys
+from collections import OrderedDict
+
+import numpy as np
+
+from benchmate.ranges.genomicranges import STRANDS, _encode_strands
+from benchmate.ranges.overlaps import OverlapIndex
+
+
+class FeatureTable:
+    def __init__(self, rows, starts, ends, strands):
+        """
+        rows of one feature query for one chromosome, sorted by start, with the coordinates kept as numpy columns so
+        that a region lookup is two binary searches. Strands are stored as their STRANDS codes.
+        :param rows: list of result rows (tuples) as returned by the feature query
+        :param starts: start of each row
+        :param ends: end of each row
+        :param strands: strand of each row
+        """
+        order = np.argsort(np.asarray(starts, dtype=np.int64), kind="stable")
+        self.rows = [rows[i] for i in order.tolist()]
+        self.starts = np.asarray(starts, dtype=np.int64)[order]
+        self.ends = np.asarray(ends, dtype=np.int64)[order]
+        self.strands = _encode_strands(np.asarray(strands, dtype=object)).astype(np.int8)[order]
+        self._index = None
+        # the estimate includes the overlap index that find_overlaps builds on first use, about four int64 per row
+        self.nbytes = (self.starts.nbytes * 5 + self.ends.nbytes + self.strands.nbytes
+                       + sum(_row_bytes(row) for row in self.rows))
+
+    def within(self, start, end, strand):
+        """
+        rows completely inside [start, end] on the given strand, same as Genome._range_filter, see row
+        """
+        lo = np.searchsorted(self.starts, start, side="left")
+        hi = np.searchsorted(self.starts, end, side="right")
+        hits = lo + np.flatnonzero((self.ends[lo:hi] <= end) & (self.strands[lo:hi] == STRANDS[strand]))
+        return [self.row(i) for i in hits.tolist()]
+
+    def find_overlaps(self, starts, ends, strands, type="any", ignore_strand=True):
+        """
+        overlaps of many regions at once, one interval join instead of a lookup per region
+        :param starts: region starts
+        :param ends: region ends
+        :param strands: region strands as "+", "-", "*" or their codes
+        :param type: one of exact, within, start, end or any, see Range.overlaps with the region as self, within is
+            rows completely inside the region
+        :param ignore_strand: match rows on either strand, otherwise the strands have to agree and "*" matches both
+        :return: region indices and row indices of every matching row, sorted by region
+        """
+        if self._index is None:
+            self._index = OverlapIndex(self.starts, self.ends)
+        region_idx, row_idx = self._index.query(starts, ends, type=type)
+        if not ignore_strand:
+            region_strands = _encode_strands(strands)[region_idx]
+            row_strands = self.strands[row_idx]
+            keep = (region_strands == row_strands) | (region_strands == STRANDS["*"]) | (row_strands == STRANDS["*"])
+            region_idx, row_idx = region_idx[keep], row_idx[keep]
+        return region_idx, row_idx
+
+    def row(self, i):
+        """
+        row i, annotation dictionaries are copied so callers can change them without touching the cache
+        """
+        return tuple(dict(value) if isinstance(value, dict) else value for value in self.rows[i])
+
+    def __len__(self):
+        return len(self.rows)
+
+
+class AnnotationCache:
+    def __init__(self, max_bytes=2 ** 30):
+        """
+        least recently used cache of FeatureTables keyed by (table name, chromosome, kind). Tables are loaded on first use and
+        the least recently used ones are dropped once the estimated size goes over max_bytes, the table that was just
+        loaded is always kept even if it is larger than the budget on its own.
+        :param max_bytes: memory budget in bytes
+        """
+        self.max_bytes = max_bytes
+        self.tables = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, table, chrom, load, kind="rows"):
+        """
+        :param table: feature table name, e.g. gene
+        :param chrom: chromosome name
+        :param load: called as load() to build the FeatureTable when it is not cached
+        :param kind: layout of the rows, queries of the same table that select different columns are cached apart
+        :return: FeatureTable
+        """
+        key = (table, chrom, kind)
+        if key in self.tables:
+            self.hits += 1
+            self.tables.move_to_end(key)
+            return self.tables[key]
+        self.misses += 1
+        features = load()
+        self.tables[key] = features
+        self.nbytes += features.nbytes
+        while self.nbytes > self.max_bytes and len(self.tables) > 1:
+            _, evicted = self.tables.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+        return features
+
+    def invalidate(self, table=None):
+        """
+        drop the cached chromosomes of a table, or everything if table is None
+        """
+        for key in list(self.tables.keys()):
+            if table is None or key[0] == table:
+                self.nbytes -= self.tables.pop(key).nbytes
+
+    def clear(self):
+        self.invalidate()
+
+    def __contains__(self, key):
+        return key in self.tables
+
+    def __len__(self):
+        return len(self.tables)
+
+    def __repr__(self):
+        return (f"AnnotationCache({len(self)} tables, {self.nbytes} of {self.max_bytes} bytes, {self.hits} hits, "
+                f"{self.misses} misses)")
+
+
+def _row_bytes(row):
+    """
+    rough size of a result row, the tuple plus its values and one level of dictionary keys and values
+    """
+    size = sys.getsizeof(row)
+    for value in row:
+        size += sys.getsizeof(value)
+        if isinstance(value, dict):
+            size += sum(sys.getsizeof(key) + sys.getsizeof(item) for key, item in value.items())
+    return size
@@ -2,20 +2,76 @@ import warnings
 
 import sqlalchemy
 from sqlalchemy.orm import sessionmaker
+import numpy as np
 import pandas as pd
 
 from Bio import Seq, SeqIO
 import pysam
 
 from benchmate.knowledge_base.tables import *
-from benchmate.genome.utils import insert_genome
+from benchmate.genome.utils import insert_genome, overlapping_bins
+from benchmate.genome.cache import AnnotationCache, FeatureTable
+from benchmate.genome.packed import PackedGenome
+from benchmate.genome.mapping import TranscriptMapper
 from benchmate.ranges.genomicranges import *
+from benchmate.ranges.genomicranges import _encode_strands
+
+# parent tables of each feature table up to the gene, every child has a <parent>_id column pointing to the parent id
+FEATURE_PARENTS = {"gene": [], "transcript": ["gene"], "exon": ["transcript", "gene"],
+                   "coding": ["exon", "transcript", "gene"], "three_utr": ["transcript", "gene"],
+                   "five_utr": ["transcript", "gene"], "intron": ["transcript", "gene"]}
+
+# complement of the IUPAC nucleotide codes, S, W and N are their own complement
+COMPLEMENT = str.maketrans("ACGTRYKMBVDHacgtrykmbvdh", "TGCAYRMKVBHDtgcayrmkvbhd")
+
+
+def fetch_sequences(fasta, chroms, starts, ends, strands, max_gap=100000, max_window=2 ** 22):
+    """
+    read many 1-based inclusive regions from an indexed fasta file. Regions are visited in chromosome and start order
+    and grouped into windows, consecutive regions closer than max_gap share one fetch as long as the window stays under
+    max_window bases, so the file is read sequentially with far fewer calls than regions.
+    :param fasta: pysam.FastaFile
+    :param chroms: reference name of each region
+    :param starts: region starts
+    :param ends: region ends
+    :param strands: strand codes (see STRANDS) or names, - strand regions are reverse complemented
+    :return: list of sequences in the order of the regions
+    """
+    chroms = np.asarray(chroms, dtype=object)
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    minus = _encode_strands(strands) == STRANDS["-"]
+    codes, names = pd.factorize(chroms)
+    order = np.lexsort((starts, codes)).tolist()
+    codes, starts, ends, minus = codes.tolist(), starts.tolist(), ends.tolist(), minus.tolist()
+
+    sequences = [None] * len(order)
+    i = 0
+    while i < len(order):
+        first = order[i]
+        window_start, window_end = starts[first], ends[first]
+        j = i + 1
+        while j < len(order):
+            k = order[j]
+            if codes[k] != codes[first] or starts[k] - window_end > max_gap or \
+                    max(window_end, ends[k]) - window_start >= max_window:
+                break
+            window_end = max(window_end, ends[k])
+            j += 1
+        window = fasta.fetch(names[codes[first]], window_start - 1, window_end)
+        for k in order[i:j]:
+            seq = window[starts[k] - window_start:ends[k] - window_start + 1]
+            sequences[k] = seq[::-1].translate(COMPLEMENT) if minus[k] else seq
+        i = j
+    return sequences
+
 
 #TODO the genome class currently is not compatible with kb
 class Genome:
     def __init__(self, genome_fasta, gtf, name, description, db_conn,
                  transcriptome_fasta=None,
-                 proteome_fasta=None, create=True,):
+                 proteome_fasta=None, create=True, cache_bytes=None, n_jobs=None,
+                 packed_genome=None):
         """
         :param gtf_path: Path to the GTF file
         :param genome_fasta: Path to the genome fasta file
@@ -23,16 +79,24 @@ class Genome:
         :param proteome_fasta: Path to the proteome fasta file
         :param db_conn: database connection object this is a sqlalchemy engine
         :param taxon_id: taxon id of the genome
+        :param cache_bytes: if given, keep the annotations of the chromosomes that were queried in memory up to this many
+            bytes and answer region queries from there, see benchmate.genome.cache
+        :param n_jobs: number of processes that parse the gtf file while it is being imported, see insert_genome
+        :param packed_genome: directory written by PackedGenome.build, if given genome sequences are read from it
+            instead of the genome fasta file
         """
         self.db=db_conn
-        self.session = sessionmaker(self.db)
+        self.session = sessionmaker(self.db)()
+        self.cache = AnnotationCache(cache_bytes) if cache_bytes is not None else None
         self.metadata = sqlalchemy.MetaData(self.db)
         self.metadata.reflect(bind=self.db)
         self.tables = self.metadata.tables
         self.gtf = gtf
         self.name = name
         self.description = description
-        if genome_fasta is not None:
+        if packed_genome is not None:
+            self.genome_fasta = PackedGenome(packed_genome)
+        elif genome_fasta is not None:
             self.genome_fasta = pysam.FastaFile(genome_fasta)
         else:
             self.genome_fasta=None
@@ -52,7 +116,7 @@ class Genome:
                 self.metadata.reflect(bind=self.db)
                 genome_id, chrom_ids = insert_genome(gtf=gtf, engine=self.db, name=self.name, description=self.description,
                                                  genome_fasta=genome_fasta, transcriptome_fasta=transcriptome_fasta, proteome_fasta=proteome_fasta,
-                                                 )
+                                                 n_jobs=n_jobs)
         else:
             genome_id = pd.read_sql(
                 f"select genome.id from genome where genome.genome_name='{self.name}'",
@@ -62,7 +126,7 @@ class Genome:
                 print("The database has all the tables but this particular genome is not in the database, adding now")
                 genome_id, chrom_ids=insert_genome(gtf=gtf, engine=self.db, name=self.name, description=self.description,
                                              genome_fasta=genome_fasta, transcriptome_fasta=transcriptome_fasta,
-                                                   proteome_fasta=proteome_fasta)
+                                                   proteome_fasta=proteome_fasta, n_jobs=n_jobs)
             elif len(genome_id)==1:
                 print(f"Found an existing genome with {name}, just setting things up, if this is an error re-initiate the class with a different name")
                 chrom_ids = pd.read_sql(f"select id, chrom from chrom where genome_id={genome_id[0]}", con=self.db)
@@ -106,14 +170,7 @@ class Genome:
             query = query.filter(genes_table.c.gene_name.in_(gene_ids))
 
 
-        if range is not None:
-            query=query.filter(
-                chroms_table.c.chrom == range.chrom,
-                genes_table.c.strand == range.strand,
-                genes_table.c.start>=range.ranges.start,
-                genes_table.c.end<=range.ranges.end)
-
-        result = self.session.execute(query).fetchall()
+        result = self._execute("gene", query, genes_table, range, filtered=gene_ids is not None)
         ranges=[]
         keys=[]
         for item in result:
@@ -170,15 +227,7 @@ class Genome:
                 ids = [ids]
             query = query.filter(transcripts_table.c.id.in_(ids))
 
-        if range is not None:
-            query=query.filter(
-                chroms_table.c.chrom == range.chrom,
-                genes_table.c.strand == range.strand,
-                transcripts_table.c.start>=range.ranges.start,
-                transcripts_table.c.end<=range.ranges.end)
-
-
-        result = self.session.execute(query).fetchall()
+        result = self._execute("transcript", query, transcripts_table, range, filtered=gene_ids is not None or ids is not None)
         res_dict={}
         for item in result:
             chrom = item[1]
@@ -242,14 +291,7 @@ class Genome:
                 ids = [ids]
             query = query.filter(exons_table.c.id.in_(ids))
 
-        if range is not None:
-            query=query.filter(
-                chroms_table.c.chrom == range.chrom,
-                genes_table.c.strand == range.strand,
-                exons_table.c.start>=range.ranges.start,
-                exons_table.c.end<=range.ranges.end)
-
-        result = self.session.execute(query).fetchall()
+        result = self._execute("exon", query, exons_table, range, filtered=transcript_ids is not None or ids is not None)
 
         res_dict = {}
         for item in result:
@@ -319,14 +361,7 @@ class Genome:
                 ids = [ids]
             query = query.filter(cds_table.c.id.in_(ids))
 
-        if range is not None:
-            query=query.filter(
-                chroms_table.c.chrom == range.chrom,
-                genes_table.c.strand <= range.strand,
-                cds_table.c.start>=range.ranges.start,
-                cds_table.c.end<=range.ranges.end)
-
-        result = self.session.execute(query).fetchall()
+        result = self._execute("coding", query, cds_table, range, filtered=transcript_ids is not None or ids is not None)
 
         res_dict = {}
         for item in result:
@@ -382,14 +417,7 @@ class Genome:
                 ids = [ids]
             query = query.filter(three_utr_table.c.id.in_(ids))
 
-        if range is not None:
-            query = query.filter(
-                chroms_table.c.chrom == range.chrom,
-                genes_table.c.strand <= range.strand,
-                three_utr_table.c.start >= range.ranges.start,
-                three_utr_table.c.end <= range.ranges.end)
-
-        result = self.session.execute(query).fetchall()
+        result = self._execute("three_utr", query, three_utr_table, range, filtered=transcript_ids is not None or ids is not None)
 
         res_dict = {}
         for item in result:
@@ -399,7 +427,7 @@ class Genome:
             strand = item[4]
             annot = item[5]
             annot["db_id"] = item[0]
-            annot["db_transcript_id"] = item[7]
+            annot["db_transcript_id"] = item[6]
             tx_id = annot["transcript_id"]
             if tx_id not in res_dict.keys():
                 res_dict[tx_id] = GenomicRangesList([])
@@ -444,14 +472,7 @@ class Genome:
                 ids = [ids]
             query = query.filter(five_utr_table.c.id.in_(ids))
 
-        if range is not None:
-            query = query.filter(
-                chroms_table.c.chrom == range.chrom,
-                genes_table.c.strand == range.strand,
-                five_utr_table.c.start >= range.ranges.start,
-                five_utr_table.c.end <= range.ranges.end)
-
-        result = self.session.execute(query).fetchall()
+        result = self._execute("five_utr", query, five_utr_table, range, filtered=transcript_ids is not None or ids is not None)
 
         res_dict = {}
         for item in result:
@@ -516,14 +537,7 @@ class Genome:
                 ids = [ids]
             query = query.filter(introns_table.c.id.in_(ids))
 
-        if range is not None:
-            query = query.filter(
-                chroms_table.c.chrom == range.chrom,
-                genes_table.c.strand == range.strand,
-                introns_table.c.start >= range.ranges.start,
-                introns_table.c.end <= range.ranges.end)
-
-        result = self.session.execute(query).fetchall()
+        result = self._execute("intron", query, introns_table, range, filtered=transcript_ids is not None or ids is not None)
 
         res_dict = {}
         for item in result:
@@ -543,29 +557,228 @@ class Genome:
         gdict = GenomicRangesDict(res_dict.keys(), res_dict.values())
         return gdict
 
+    def features_in(self, regions, feature="gene", type="any", ignore_strand=True):
+        """
+        features overlapping each of many regions, e.g. variants or peaks. Instead of a query per region there is one
+        query per chromosome (or none if the chromosome is already in the annotation cache) and the regions are matched
+        to the features with an in memory interval join.
+        :param regions: GenomicRanges, GenomicRangesList or a list of GenomicRange objects
+        :param feature: one of gene, transcript, exon, coding, three_utr, five_utr, intron
+        :param type: one of exact, within, start, end or any, see Range.overlaps with the region as self. any returns
+            every feature that shares a base with the region, within only the features completely inside it like the
+            range argument of genes, transcripts etc.
+        :param ignore_strand: match features on either strand, otherwise the strands have to agree and "*" regions
+            match both
+        :return: pandas DataFrame with one row per (region, feature) pair sorted by region, the columns are query (the
+            position of the region in regions), db_id, chrom, start, end, strand and annotations
+        """
+        if feature not in FEATURE_PARENTS:
+            raise ValueError(f"feature must be one of {list(FEATURE_PARENTS.keys())}")
+        check_overlap_type(type)
+        if not isinstance(regions, GenomicRanges):
+            regions = GenomicRanges.from_list(regions)
+
+        columns = {"query": [], "db_id": [], "chrom": [], "start": [], "end": [], "strand": [], "annotations": []}
+        query = self._feature_select(feature)
+        table = self.tables[feature]
+        for code, chrom in enumerate(regions.chrom_names.tolist()):
+            members = np.flatnonzero(regions.chrom_codes == code)
+            if members.shape[0] == 0:
+                continue
+            starts = regions.starts[members]
+            ends = regions.ends[members]
+            if self.cache is not None:
+                features = self.cache.get(feature, chrom, lambda: self._load_features(query, table, chrom, rows=2),
+                                          kind="regions")
+            else:
+                # only the features overlapping the span of the regions on this chromosome are read
+                features = self._load_features(query.filter(table.c.end >= int(starts.min()),
+                                                            table.c.start <= int(ends.max())), table, chrom, rows=2)
+            region_idx, row_idx = features.find_overlaps(starts, ends, regions.strands[members], type=type,
+                                                         ignore_strand=ignore_strand)
+            rows = [features.row(i) for i in row_idx.tolist()]
+            columns["query"].append(members[region_idx])
+            columns["db_id"].append(np.asarray([row[0] for row in rows], dtype=np.int64))
+            columns["chrom"].append(np.full(row_idx.shape[0], chrom, dtype=object))
+            columns["start"].append(features.starts[row_idx])
+            columns["end"].append(features.ends[row_idx])
+            columns["strand"].append(STRAND_NAMES[features.strands[row_idx]])
+            annotations = np.empty(row_idx.shape[0], dtype=object)
+            annotations[:] = [row[1] for row in rows]
+            columns["annotations"].append(annotations)
+
+        result = pd.DataFrame({name: np.concatenate(values) if values else np.empty(0, dtype=object)
+                               for name, values in columns.items()})
+        return result.sort_values(["query", "start", "end"], kind="stable", ignore_index=True)
+
+    def _feature_select(self, name, columns=None):
+        """
+        db id and annotations of a feature table joined through its parents to the chrom table, the same two columns
+        for every table, see features_in
+        :param columns: select these columns instead
+        """
+        chroms_table = self.tables['chrom']
+        table = self.tables[name]
+        if columns is None:
+            columns = [table.c.id, table.c.annotations]
+        query = sqlalchemy.select(*columns).select_from(table)
+        child = table
+        for parent in FEATURE_PARENTS[name]:
+            parent_table = self.tables[parent]
+            query = query.join(parent_table, child.c[f"{parent}_id"] == parent_table.c.id)
+            child = parent_table
+        return query.join(chroms_table, self.tables['gene'].c.chrom_id == chroms_table.c.id)
+
+    def _execute(self, name, query, table, range=None, filtered=False):
+        """
+        run a feature query, restricted to range if there is one. Region queries without other filters are answered
+        from the annotation cache when the genome has one, the chromosome is loaded with a single query the first time
+        :param name: table name, the cache key
+        :param query: select joined with the chrom and gene tables
+        :param table: feature table of the query
+        :param range: optional GenomicRange
+        :param filtered: the query has other filters (ids) so it cannot be served from the cache
+        :return: list of result rows
+        """
+        if range is None:
+            return self.session.execute(query).fetchall()
+        if self.cache is None or filtered:
+            return self.session.execute(self._range_filter(query, table, range)).fetchall()
+        features = self.cache.get(name, range.chrom, lambda: self._load_features(query, table, range.chrom))
+        return features.within(range.ranges.start, range.ranges.end, range.strand)
+
+    def _load_features(self, query, table, chrom, rows=None):
+        """
+        all rows of a feature query on one chromosome with the coordinates as columns, see AnnotationCache
+        :param rows: number of leading query columns kept in the rows, all of them if None
+        """
+        query=query.add_columns(table.c.start, table.c.end, self.tables['gene'].c.strand).filter(
+            self.tables['chrom'].c.chrom == chrom)
+        result=self.session.execute(query).fetchall()
+        rows = -3 if rows is None else rows
+        return FeatureTable([tuple(row)[:rows] for row in result], [row[-3] for row in result],
+                            [row[-2] for row in result], [row[-1] for row in result])
+
+    def _range_filter(self, query, table, range):
+        """
+        restrict a feature query to the features within range on the same chromosome and strand. If the table has a
+        bin column only the UCSC bins that can hold such features are searched, which lets the database use the range
+        index instead of scanning the whole table
+        :param query: select joined with the chrom and gene tables
+        :param table: feature table of the query
+        :param range: GenomicRange
+        :return: filtered query
+        """
+        query=query.filter(
+            self.tables['chrom'].c.chrom == range.chrom,
+            self.tables['gene'].c.strand == range.strand,
+            table.c.start >= range.ranges.start,
+            table.c.end <= range.ranges.end)
+        if "bin" in table.c:
+            query=query.filter(table.c.bin.in_(overlapping_bins(range.ranges.start, range.ranges.end)))
+        return query
+
     def get_sequence(self, genomic_range, type='genome'):
         """
         Get the sequence of a genomic range. This takes a single genomc range you can iterate over a GenomicRangeList or GenomicRangeDict
         :param genomic_range: GenomicRange object
         :return: sequence as string
         """
-        if type == 'genome':
-            file= self.genome_fasta
-        elif type == 'transcriptome':
-            file=self.transcriptome_fasta
-        elif type == 'proteome':
-            file=self.proteome_fasta
-
+        file = self._fasta(type)
         if genomic_range.chrom not in file.references:
-            raise ValueError(f"Chromosome {genomic_range.chromosome} not found in genome fasta file.")
+            raise ValueError(f"Chromosome {genomic_range.chrom} not found in genome fasta file.")
         start = genomic_range.ranges.start
         end = genomic_range.ranges.end
         strand = genomic_range.strand
-        seq = file.fetch(genomic_range.chrom, start, end)
+        # pysam takes 0-based half open coordinates
+        seq = file.fetch(genomic_range.chrom, start - 1, end)
         if strand == '-':
             seq = str(Seq.Seq(seq).reverse_complement())
         return seq
 
+    def get_sequences(self, regions, type='genome', max_gap=100000):
+        """
+        sequences of many regions in one call. The regions are read in chromosome and start order, nearby regions with
+        a single fetch of the stretch around them, and the - strand ones are reverse complemented. Grouped regions are
+        joined per group in transcript order, by start and by descending start on the - strand, so exons by transcript
+        give spliced transcripts and cds by transcript coding sequences, see spliced_sequences.
+        :param regions: GenomicRanges, list of GenomicRange objects or a GroupedGenomicRanges
+        :param type: genome, transcriptome or proteome, same as get_sequence
+        :param max_gap: regions at most this many bases apart are read with one fetch
+        :return: list of sequences in the order of the regions, for GroupedGenomicRanges a dictionary of group name (or
+            number if the groups have no names) to the joined sequence
+        """
+        grouped = isinstance(regions, GroupedGenomicRanges)
+        if grouped:
+            granges = regions.ranges
+        elif isinstance(regions, GenomicRanges):
+            granges = regions
+        else:
+            granges = GenomicRanges.from_list(regions)
+
+        file = self._fasta(type)
+        missing = set(granges.chrom_names.tolist()) - set(file.references)
+        if missing:
+            raise ValueError(f"Chromosomes {sorted(missing)} not found in {type} fasta file.")
+        pieces = fetch_sequences(file, granges.chroms, granges.starts, granges.ends, granges.strands, max_gap=max_gap)
+        if not grouped:
+            return pieces
+
+        groups = regions.group_index
+        order = np.lexsort((np.where(granges.strands == STRANDS["-"], -granges.starts.astype(np.int64),
+                                     granges.starts), groups)).tolist()
+        offsets = regions.offsets.tolist()
+        names = regions.names.tolist() if regions.names is not None else range(len(regions))
+        return {name: "".join(pieces[i] for i in order[offsets[k]:offsets[k + 1]]) for k, name in enumerate(names)}
+
+    def spliced_sequences(self, feature="exon", transcript_ids=None):
+        """
+        spliced sequences of transcripts from the genome fasta, exons give the transcript and coding the coding
+        sequence. The exons (or cds) of all transcripts are read with one query and the sequences with get_sequences.
+        :param feature: exon or coding
+        :param transcript_ids: transcript ids from the gtf file, None for all transcripts
+        :return: dictionary of transcript id to sequence, transcripts without cds are left out for coding
+        """
+        if feature not in ("exon", "coding"):
+            raise ValueError("feature must be exon or coding")
+        table = self.tables[feature]
+        transcripts_table = self.tables['transcript']
+        query = self._feature_select(feature, [transcripts_table.c.transcript_id, self.tables['chrom'].c.chrom,
+                                               table.c.start, table.c.end, self.tables['gene'].c.strand])
+        if transcript_ids is not None:
+            if type(transcript_ids) is str:
+                transcript_ids = [transcript_ids]
+            query = query.filter(transcripts_table.c.transcript_id.in_(transcript_ids))
+        rows = self.session.execute(query).fetchall()
+        if len(rows) == 0:
+            return {}
+        names, chroms, starts, ends, strands = zip(*rows)
+        granges = GenomicRanges(np.asarray(chroms, dtype=object), np.asarray(starts), np.asarray(ends),
+                                np.asarray(strands, dtype=object))
+        return self.get_sequences(GroupedGenomicRanges.from_groups(granges, np.asarray(names, dtype=object)))
+
+    def transcript_mapper(self, transcript_ids=None):
+        """
+        local genome, transcript, cds and protein coordinate conversion built from the exon and cds tables with one
+        query each, see benchmate.genome.mapping. Build it once and reuse it, conversions are vectorized.
+        :param transcript_ids: transcript ids from the gtf file, None for all transcripts
+        :return: TranscriptMapper
+        """
+        return TranscriptMapper.from_genome(self, transcript_ids)
+
+    def _fasta(self, type):
+        if type == 'genome':
+            file= self.genome_fasta
+        elif type == 'transcriptome':
+            file=self.transcriptome_fasta
+        elif type == 'proteome':
+            file=self.proteome_fasta
+        else:
+            raise ValueError(f"type must be genome, transcriptome or proteome, not {type}")
+        if file is None:
+            raise ValueError(f"There is no {type} fasta file for this genome")
+        return file
+
     def add_annotation(self, table, row_id, annots):
         """
         add arbitrary annotations as a dictionary to a specific row in a specific table
@@ -584,7 +797,7 @@ class Genome:
         elif table=="exon":
             table=self.tables['exon']
         elif table=="cds":
-            table=self.tables['cds']
+            table=self.tables['coding']
         elif table=="three_utr":
             table=self.tables['three_utr']
         elif table=="five_utr":
@@ -617,6 +830,9 @@ class Genome:
                 sqlalchemy.update(table.c.annot).where(table.c.id==row_id).values(current_annots)
             except Exception as e:
                 print(f"There was an error in updating the annotations: {e}")
+            if self.cache is not None:
+                # cached rows carry the old annotations
+                self.cache.invalidate(table.name)
         else:
             raise ValueError("The id returned 0 row, please make sure that the id you provided is correct")
 
@@ -0,0 +1,244 @@
+import numpy as np
+import pandas as pd
+
+from benchmate.ranges.genomicranges import STRANDS, _encode_strands
+from benchmate.ranges.overlaps import OverlapIndex
+
+# Local coordinate mapping between the genome, transcripts, coding sequences and proteins, built from the exon and cds
+# tables instead of asking the Ensembl REST api (see Ensembl.mapping). All positions are 1-based. Transcript positions
+# count the bases of the spliced transcript from its 5' end, cds positions count from the first base of the start
+# codon and protein positions are codon numbers. Positions that do not map (intronic, outside the transcript or outside
+# the cds) are UNMAPPED.
+
+UNMAPPED = -1
+
+# transcript number * TRANSCRIPT_KEY + genomic position orders the exons of all transcripts in one searchable array
+TRANSCRIPT_KEY = 2 ** 32
+
+
+class TranscriptMapper:
+    def __init__(self, names, chroms, strands, exon_offsets, exon_starts, exon_ends, cds_starts=None, cds_ends=None):
+        """
+        exon structures of many transcripts as flat arrays, exons of transcript i are
+        exon_starts[exon_offsets[i]:exon_offsets[i + 1]] in transcript order (by descending start on the - strand).
+        For every exon the transcript position of its first base is kept, so converting a transcript position is a
+        binary search over these offsets and converting a genomic position a binary search over the exon starts.
+        :param names: transcript ids
+        :param chroms: chromosome of each transcript
+        :param strands: strand of each transcript, "+", "-" or STRANDS codes
+        :param exon_offsets: int64 array of length number of transcripts + 1
+        :param exon_starts: genomic start of each exon
+        :param exon_ends: genomic end of each exon
+        :param cds_starts: transcript position of the first cds base of each transcript, UNMAPPED for non coding ones
+        :param cds_ends: transcript position of the last cds base
+        """
+        self.names = np.asarray(names, dtype=object)
+        self.chroms = np.asarray(chroms, dtype=object)
+        self.strands = _encode_strands(np.asarray(strands)).astype(np.int8)
+        self.exon_offsets = np.asarray(exon_offsets, dtype=np.int64)
+        self.exon_starts = np.asarray(exon_starts, dtype=np.int64)
+        self.exon_ends = np.asarray(exon_ends, dtype=np.int64)
+        n = self.names.shape[0]
+        if self.exon_offsets.shape[0] != n + 1 or self.exon_offsets[-1] != self.exon_starts.shape[0]:
+            raise ValueError("exon_offsets must have one entry per transcript plus one and end at the number of exons")
+        self.cds_starts = np.full(n, UNMAPPED, dtype=np.int64) if cds_starts is None \
+            else np.asarray(cds_starts, dtype=np.int64)
+        self.cds_ends = np.full(n, UNMAPPED, dtype=np.int64) if cds_ends is None \
+            else np.asarray(cds_ends, dtype=np.int64)
+
+        lengths = self.exon_ends - self.exon_starts + 1
+        self.exon_transcripts = np.repeat(np.arange(n), np.diff(self.exon_offsets))
+        totals = np.concatenate([[0], np.cumsum(lengths)])
+        # transcript position of the first base of every exon and the spliced length of every transcript
+        self.exon_positions = totals[:-1] - totals[self.exon_offsets[:-1]][self.exon_transcripts] + 1
+        self.lengths = totals[self.exon_offsets[1:]] - totals[self.exon_offsets[:-1]]
+        # the transcripts laid end to end, position p of transcript t is at transcript_bases[t] + p
+        self.transcript_bases = np.concatenate([[0], np.cumsum(self.lengths)[:-1]]).astype(np.int64)
+        self.exon_bases = self.transcript_bases[self.exon_transcripts] + self.exon_positions
+        self.genomic_order = np.lexsort((self.exon_starts, self.exon_transcripts))
+        self.genomic_keys = self.exon_transcripts[self.genomic_order] * TRANSCRIPT_KEY \
+            + self.exon_starts[self.genomic_order]
+        self._lookup = None
+        self._index = None
+
+    @classmethod
+    def from_genome(cls, genome, transcript_ids=None):
+        """
+        read the exons and cds of the transcripts from a Genome with one query each
+        :param genome: benchmate.genome.genome.Genome
+        :param transcript_ids: transcript ids from the gtf file, None for all transcripts
+        """
+        transcripts_table = genome.tables['transcript']
+        columns = {}
+        for feature in ("exon", "coding"):
+            table = genome.tables[feature]
+            query = genome._feature_select(feature, [transcripts_table.c.transcript_id, genome.tables['chrom'].c.chrom,
+                                                     genome.tables['gene'].c.strand, table.c.start, table.c.end])
+            if transcript_ids is not None:
+                if type(transcript_ids) is str:
+                    transcript_ids = [transcript_ids]
+                query = query.filter(transcripts_table.c.transcript_id.in_(transcript_ids))
+            columns[feature] = pd.DataFrame(genome.session.execute(query).fetchall(),
+                                            columns=["transcript_id", "chrom", "strand", "start", "end"])
+        return cls.from_frames(columns["exon"], columns["coding"])
+
+    @classmethod
+    def from_frames(cls, exons, coding=None):
+        """
+        :param exons: DataFrame with transcript_id, chrom, strand, start and end columns, one row per exon
+        :param coding: DataFrame with transcript_id, start and end, one row per cds piece, optional
+        """
+        codes, names = pd.factorize(exons["transcript_id"].to_numpy(dtype=object))
+        starts = exons["start"].to_numpy(dtype=np.int64)
+        strands = _encode_strands(exons["strand"].to_numpy())
+        # transcript order, the - strand exons go down the genome
+        order = np.lexsort((np.where(strands == STRANDS["-"], -starts, starts), codes))
+        first = order[np.concatenate([[0], np.flatnonzero(np.diff(codes[order])) + 1])] if order.shape[0] else order
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(codes, minlength=len(names)))])
+        mapper = cls(names, exons["chrom"].to_numpy(dtype=object)[first], strands[first], offsets, starts[order],
+                     exons["end"].to_numpy(dtype=np.int64)[order])
+        if coding is not None and not coding.empty:
+            spans = coding.groupby("transcript_id", sort=False).agg(start=("start", "min"), end=("end", "max"))
+            spans = spans[spans.index.isin(names)]
+            transcripts = mapper.transcript_numbers(spans.index.to_numpy(dtype=object))
+            minus = mapper.strands[transcripts] == STRANDS["-"]
+            five = np.where(minus, spans["end"].to_numpy(), spans["start"].to_numpy())
+            three = np.where(minus, spans["start"].to_numpy(), spans["end"].to_numpy())
+            mapper.cds_starts[transcripts] = mapper.genome_to_transcript(transcripts, five)
+            mapper.cds_ends[transcripts] = mapper.genome_to_transcript(transcripts, three)
+        return mapper
+
+    def transcript_numbers(self, transcripts):
+        """
+        :param transcripts: transcript ids or transcript numbers (positions in names), a single value or an array
+        :return: int64 array of transcript numbers
+        """
+        transcripts = np.atleast_1d(np.asarray(transcripts))
+        if transcripts.dtype.kind in "iu":
+            return transcripts.astype(np.int64)
+        if self._lookup is None:
+            self._lookup = pd.Index(self.names)
+        numbers = self._lookup.get_indexer(transcripts.astype(object))
+        if (numbers < 0).any():
+            raise KeyError(f"unknown transcripts: {transcripts[numbers < 0][:5].tolist()}")
+        return numbers.astype(np.int64)
+
+    def transcript_to_genome(self, transcripts, positions):
+        """
+        :param transcripts: transcript of each position, see transcript_numbers
+        :param positions: transcript positions
+        :return: genomic positions, UNMAPPED for positions outside the transcript
+        """
+        transcripts, positions = self._broadcast(transcripts, positions)
+        valid = (positions >= 1) & (positions <= self.lengths[transcripts])
+        exon = np.searchsorted(self.exon_bases, self.transcript_bases[transcripts] + positions, side="right") - 1
+        exon = np.clip(exon, 0, max(self.exon_starts.shape[0] - 1, 0))
+        if exon.shape[0] == 0:
+            return np.empty(0, dtype=np.int64)
+        into = positions - self.exon_positions[exon]
+        genomic = np.where(self.strands[transcripts] == STRANDS["-"], self.exon_ends[exon] - into,
+                           self.exon_starts[exon] + into)
+        return np.where(valid, genomic, UNMAPPED)
+
+    def genome_to_transcript(self, transcripts, positions):
+        """
+        :param transcripts: transcript of each position, see transcript_numbers
+        :param positions: genomic positions on the chromosome of the transcript
+        :return: transcript positions, UNMAPPED for positions that are not in an exon of the transcript
+        """
+        transcripts, positions = self._broadcast(transcripts, positions)
+        if self.genomic_keys.shape[0] == 0:
+            return np.full(positions.shape[0], UNMAPPED, dtype=np.int64)
+        found = np.searchsorted(self.genomic_keys, transcripts * TRANSCRIPT_KEY + positions, side="right") - 1
+        exon = self.genomic_order[np.maximum(found, 0)]
+        valid = (found >= 0) & (self.exon_transcripts[exon] == transcripts) & (positions >= self.exon_starts[exon]) \
+            & (positions <= self.exon_ends[exon])
+        into = np.where(self.strands[transcripts] == STRANDS["-"], self.exon_ends[exon] - positions,
+                        positions - self.exon_starts[exon])
+        return np.where(valid, self.exon_positions[exon] + into, UNMAPPED)
+
+    def transcript_to_cds(self, transcripts, positions):
+        """
+        :return: cds positions, UNMAPPED outside the cds and for non coding transcripts
+        """
+        transcripts, positions = self._broadcast(transcripts, positions)
+        cds_starts = self.cds_starts[transcripts]
+        valid = (cds_starts != UNMAPPED) & (positions >= cds_starts) & (positions <= self.cds_ends[transcripts])
+        return np.where(valid, positions - cds_starts + 1, UNMAPPED)
+
+    def cds_to_transcript(self, transcripts, positions):
+        transcripts, positions = self._broadcast(transcripts, positions)
+        cds_starts = self.cds_starts[transcripts]
+        valid = (cds_starts != UNMAPPED) & (positions >= 1) & (positions <= self.cds_ends[transcripts] - cds_starts + 1)
+        return np.where(valid, positions + cds_starts - 1, UNMAPPED)
+
+    def genome_to_protein(self, transcripts, positions):
+        """
+        :return: protein (codon) positions and the position of the base in its codon (0, 1 or 2), both UNMAPPED for
+            positions outside the cds
+        """
+        transcripts, positions = self._broadcast(transcripts, positions)
+        cds = self.transcript_to_cds(transcripts, self.genome_to_transcript(transcripts, positions))
+        return cds_to_protein(cds)
+
+    def protein_to_genome(self, transcripts, positions):
+        """
+        :return: genomic position of the first base (in transcript order) of each codon
+        """
+        transcripts, positions = self._broadcast(transcripts, positions)
+        cds = np.where(positions >= 1, (positions - 1) * 3 + 1, UNMAPPED)
+        return self.transcript_to_genome(transcripts, self.cds_to_transcript(transcripts, cds))
+
+    def annotate(self, chroms, positions):
+        """
+        map genomic positions, e.g. variants, to every transcript whose exons contain them. Transcripts are found with
+        an OverlapIndex over their spans so nothing is queried per position.
+        :param chroms: chromosome of each position, or a single name for all of them
+        :param positions: genomic positions
+        :return: DataFrame with one row per (position, transcript) pair sorted by position, the columns are query (the
+            position of the input), transcript_id, transcript_position, cds_position, protein_position and codon_position,
+            the last three are UNMAPPED for positions outside the cds
+        """
+        positions = np.atleast_1d(np.asarray(positions, dtype=np.int64))
+        chroms = np.broadcast_to(np.asarray(chroms, dtype=object), positions.shape)
+        if self._index is None:
+            first = self.exon_offsets[:-1]
+            last = np.maximum(self.exon_offsets[1:] - 1, 0)
+            spans = np.stack([self.exon_starts[first], self.exon_ends[first], self.exon_starts[last],
+                              self.exon_ends[last]])
+            self._chrom_codes, self._chrom_names = pd.factorize(self.chroms)
+            self._index = OverlapIndex(spans.min(axis=0), spans.max(axis=0), self._chrom_codes)
+        codes = pd.Index(self._chrom_names).get_indexer(chroms)
+        # unknown chromosomes get -1 which is not a group of the index
+        query, transcripts = self._index.query(positions, positions, codes, type="any")
+
+        transcript_positions = self.genome_to_transcript(transcripts, positions[query])
+        exonic = transcript_positions != UNMAPPED
+        query, transcripts, transcript_positions = query[exonic], transcripts[exonic], transcript_positions[exonic]
+        cds = self.transcript_to_cds(transcripts, transcript_positions)
+        protein, codon = cds_to_protein(cds)
+        return pd.DataFrame({"query": query, "transcript_id": self.names[transcripts],
+                             "transcript_position": transcript_positions, "cds_position": cds,
+                             "protein_position": protein, "codon_position": codon})
+
+    def _broadcast(self, transcripts, positions):
+        positions = np.atleast_1d(np.asarray(positions, dtype=np.int64))
+        transcripts = np.broadcast_to(self.transcript_numbers(transcripts), positions.shape)
+        return transcripts, positions
+
+    def __len__(self):
+        return self.names.shape[0]
+
+    def __repr__(self):
+        return f"TranscriptMapper({len(self)} transcripts, {self.exon_starts.shape[0]} exons)"
+
+
+def cds_to_protein(positions):
+    """
+    :param positions: cds positions, UNMAPPED values stay UNMAPPED
+    :return: protein (codon) positions and the position of the base in its codon
+    """
+    positions = np.asarray(positions, dtype=np.int64)
+    valid = positions >= 1
+    return (np.where(valid, (positions - 1) // 3 + 1, UNMAPPED),
+            np.where(valid, (positions - 1) % 3, UNMAPPED))
@@ -0,0 +1,322 @@
+import argparse
+import json
+import os
+
+import numpy as np
+import pysam
+
+# Packed genome store, a directory with the sequence of every chromosome as one numpy file that is memory mapped when
+# it is opened. Bases are stored as the codes in BASES, either one byte per base (uint8) so that region fetches are
+# views into the mapped file, or four bases per byte (2bit) with the positions of the N bases kept as runs. Build it
+# once with
+#   python -m benchmate.genome.packed genome.fa genome_packed --encoding 2bit
+# soft masking (lower case) is not kept and IUPAC ambiguity codes are stored as N.
+
+PACKED_FORMAT = "benchmate.packedgenome"
+PACKED_VERSION = 1
+ENCODINGS = ["uint8", "2bit"]
+
+BASES = np.frombuffer(b"ACGTN", dtype=np.uint8)
+N_CODE = 4
+GC_CODES = (1, 2)
+
+# ascii byte to base code, everything that is not ACGT (either case) is N
+ENCODE = np.full(256, N_CODE, dtype=np.uint8)
+for _code, _base in enumerate("ACGT"):
+    ENCODE[ord(_base)] = _code
+    ENCODE[ord(_base.lower())] = _code
+
+
+def encode(sequence):
+    """
+    :param sequence: nucleotide string
+    :return: uint8 array of base codes
+    """
+    return ENCODE[np.frombuffer(sequence.encode("ascii"), dtype=np.uint8)]
+
+
+def decode(codes):
+    """
+    :param codes: array of base codes
+    :return: nucleotide string
+    """
+    return BASES[codes].tobytes().decode("ascii")
+
+
+class PackedGenome:
+    def __init__(self, path, mmap=True):
+        """
+        open a store written by PackedGenome.build. references and lengths follow pysam.FastaFile and fetch returns
+        strings like it does, so a PackedGenome can be used wherever the genome fasta file is, see Genome.
+        :param path: directory written by build
+        :param mmap: memory map the sequence, if False it is read into memory
+        """
+        with open(os.path.join(path, "metadata.json")) as handle:
+            metadata = json.load(handle)
+        if metadata.get("format") != PACKED_FORMAT or metadata.get("version") != PACKED_VERSION:
+            raise ValueError(f"{path} is not a packed genome directory written by PackedGenome.build")
+        mode = "r" if mmap else None
+        self.path = path
+        self.encoding = metadata["encoding"]
+        self.references = tuple(metadata["references"])
+        self.lengths = tuple(metadata["lengths"])
+        # base offset of every chromosome in the sequence, multiples of 4 so 2bit chromosomes start on a byte
+        self.offsets = dict(zip(self.references, metadata["offsets"]))
+        self.sizes = dict(zip(self.references, self.lengths))
+        self.sequence = np.load(os.path.join(path, "sequence.npy"), mmap_mode=mode)
+        if self.encoding == "2bit":
+            self.n_starts = np.load(os.path.join(path, "n_starts.npy"), mmap_mode=mode)
+            self.n_ends = np.load(os.path.join(path, "n_ends.npy"), mmap_mode=mode)
+
+    @classmethod
+    def build(cls, fasta, path, encoding="uint8"):
+        """
+        encode an indexed fasta file, one chromosome at a time
+        :param fasta: path to the fasta file (with a .fai index, pysam creates it if it can) or a pysam.FastaFile
+        :param path: directory to write to, created if it does not exist
+        :param encoding: uint8 or 2bit
+        :return: the opened PackedGenome
+        """
+        if encoding not in ENCODINGS:
+            raise ValueError(f"encoding must be one of {ENCODINGS}")
+        if not isinstance(fasta, pysam.FastaFile):
+            fasta = pysam.FastaFile(fasta)
+        references = list(fasta.references)
+        lengths = [int(length) for length in fasta.lengths]
+        padded = [-(-length // 4) * 4 for length in lengths]
+        offsets = np.concatenate([[0], np.cumsum(padded, dtype=np.int64)[:-1]]).tolist()
+        total = int(sum(padded))
+
+        os.makedirs(path, exist_ok=True)
+        size = total if encoding == "uint8" else total // 4
+        sequence = np.lib.format.open_memmap(os.path.join(path, "sequence.npy"), mode="w+", dtype=np.uint8,
+                                             shape=(size,))
+        n_starts = []
+        n_ends = []
+        for reference, length, offset in zip(references, lengths, offsets):
+            codes = encode(fasta.fetch(reference))
+            if encoding == "uint8":
+                sequence[offset:offset + length] = codes
+                continue
+            starts, ends = _runs(codes == N_CODE)
+            n_starts.append(starts + offset)
+            n_ends.append(ends + offset)
+            sequence[offset // 4:(offset + length + 3) // 4] = _pack(codes)
+        sequence.flush()
+        del sequence
+
+        if encoding == "2bit":
+            np.save(os.path.join(path, "n_starts.npy"), np.concatenate([np.empty(0, dtype=np.int64)] + n_starts))
+            np.save(os.path.join(path, "n_ends.npy"), np.concatenate([np.empty(0, dtype=np.int64)] + n_ends))
+        metadata = {"format": PACKED_FORMAT, "version": PACKED_VERSION, "encoding": encoding,
+                    "references": references, "lengths": lengths, "offsets": offsets}
+        with open(os.path.join(path, "metadata.json"), "w") as handle:
+            json.dump(metadata, handle)
+        return cls(path)
+
+    def codes(self, chrom, start=1, end=None):
+        """
+        base codes (see BASES) of the 1-based inclusive region, a read only view into the mapped file for uint8 stores
+        and a new array for 2bit ones. The region is clipped to the chromosome.
+        :param chrom: chromosome name
+        :param start: region start
+        :param end: region end, None for the end of the chromosome
+        :return: uint8 array
+        """
+        lo, hi = self._bounds(chrom, start, end)
+        if self.encoding == "uint8":
+            return self.sequence[lo:hi]
+        packed = self.sequence[lo // 4:(hi + 3) // 4]
+        codes = _unpack(packed)[lo % 4:lo % 4 + hi - lo]
+        first = np.searchsorted(self.n_ends, lo, side="right")
+        last = np.searchsorted(self.n_starts, hi, side="left")
+        for run_start, run_end in zip(self.n_starts[first:last].tolist(), self.n_ends[first:last].tolist()):
+            codes[max(run_start, lo) - lo:min(run_end, hi) - lo] = N_CODE
+        return codes
+
+    def fetch(self, reference, start=None, end=None):
+        """
+        same as pysam.FastaFile.fetch, 0-based half open coordinates
+        :return: sequence string, upper case
+        """
+        start = 0 if start is None else start
+        return decode(self.codes(reference, start + 1, end))
+
+    def windows(self, chrom, width, step=1, start=1, end=None):
+        """
+        codes of all the windows of width bases every step bases in a region, as a 2d strided view without copying for
+        uint8 stores. Row i is the window starting at start + i * step.
+        :return: uint8 array of shape (number of windows, width)
+        """
+        codes = self.codes(chrom, start, end)
+        if codes.shape[0] < width:
+            return np.empty((0, width), dtype=np.uint8)
+        return np.lib.stride_tricks.sliding_window_view(codes, width)[::step]
+
+    def gc_content(self, chroms, starts, ends, block_size=2 ** 24):
+        """
+        fraction of G and C among the A, C, G and T bases of many 1-based inclusive windows, nan for windows that are
+        all N. Windows are processed per chromosome in blocks of block_size bases with prefix sums, the cost does not
+        depend on how much the windows overlap.
+        :param chroms: chromosome of each window, or a single name for all of them
+        :param starts: window starts
+        :param ends: window ends
+        :return: float64 array in the order of the windows
+        """
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        chroms = np.broadcast_to(np.asarray(chroms, dtype=object), starts.shape)
+        gc = np.zeros(starts.shape[0], dtype=np.int64)
+        acgt = np.zeros(starts.shape[0], dtype=np.int64)
+        for chrom in np.unique(chroms).tolist():
+            members = np.flatnonzero(chroms == chrom)
+            blocks = (starts[members] - 1) // block_size
+            for block in np.unique(blocks).tolist():
+                rows = members[blocks == block]
+                lo = int(starts[rows].min())
+                codes = self.codes(chrom, lo, int(ends[rows].max()))
+                gc_sums = np.concatenate([[0], np.cumsum((codes == GC_CODES[0]) | (codes == GC_CODES[1]))])
+                acgt_sums = np.concatenate([[0], np.cumsum(codes != N_CODE)])
+                # clipped to the chromosome like codes
+                first = starts[rows] - lo
+                last = np.minimum(ends[rows] - lo + 1, codes.shape[0])
+                gc[rows] = gc_sums[last] - gc_sums[first]
+                acgt[rows] = acgt_sums[last] - acgt_sums[first]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(acgt > 0, gc / acgt, np.nan)
+
+    def kmer_counts(self, chrom, start=1, end=None, k=3, block_size=2 ** 22):
+        """
+        number of times each k-mer occurs in a region, k-mers with an N are not counted. The region is read in blocks of
+        block_size bases so memory does not grow with its length.
+        :return: int64 array of length 4 ** k, k-mer i is the base 4 number with the codes of its bases (AAA is 0,
+            AAC is 1 ... TTT is 63), see kmer_names
+        """
+        counts = np.zeros(4 ** k, dtype=np.int64)
+        for _, codes in self._blocks(chrom, start, end, block_size, k - 1):
+            n = min(block_size, codes.shape[0] - k + 1)
+            if n <= 0:
+                continue
+            index, valid = _kmer_index(codes, k, n)
+            counts += np.bincount(index[valid], minlength=4 ** k)
+        return counts
+
+    def find_motif(self, chrom, motif, start=1, end=None, both_strands=True, block_size=2 ** 22):
+        """
+        exact matches of a motif in a region, N in the motif matches any base and N in the genome matches nothing. The
+        region is read in blocks of block_size bases and compared one motif position at a time.
+        :param motif: nucleotide string
+        :param both_strands: also search the reverse complement of the motif
+        :return: 1-based start of every match and its strand ("+" or "-"), sorted by position
+        """
+        pattern = encode(motif)
+        width = pattern.shape[0]
+        patterns = [("+", pattern)]
+        reverse = np.where(pattern == N_CODE, N_CODE, 3 - pattern)[::-1]
+        if both_strands and not np.array_equal(reverse, pattern):
+            patterns.append(("-", reverse))
+
+        positions = [np.empty(0, dtype=np.int64)]
+        strands = [np.empty(0, dtype=object)]
+        for block_start, codes in self._blocks(chrom, start, end, block_size, width - 1):
+            n = min(block_size, codes.shape[0] - width + 1)
+            if n <= 0:
+                continue
+            for strand, values in patterns:
+                matches = np.ones(n, dtype=bool)
+                for i, value in enumerate(values.tolist()):
+                    column = codes[i:i + n]
+                    matches &= (column != N_CODE) if value == N_CODE else (column == value)
+                hits = np.flatnonzero(matches)
+                positions.append(hits + block_start)
+                strands.append(np.full(hits.shape[0], strand, dtype=object))
+        positions = np.concatenate(positions)
+        strands = np.concatenate(strands)
+        order = np.argsort(positions, kind="stable")
+        return positions[order], strands[order]
+
+    def _blocks(self, chrom, start, end, block_size, overlap):
+        """
+        codes of a region in blocks of block_size bases, each followed by the next overlap bases so that windows of
+        overlap + 1 bases starting in the block are complete
+        :return: generator of (1-based start of the block, codes)
+        """
+        lo, hi = self._bounds(chrom, start, end)
+        offset = self.offsets[chrom]
+        for block in range(lo, hi, block_size):
+            yield block - offset + 1, self.codes(chrom, block - offset + 1, min(block + block_size + overlap, hi) - offset)
+
+    def _bounds(self, chrom, start, end):
+        if chrom not in self.offsets:
+            raise ValueError(f"Chromosome {chrom} not found in the packed genome")
+        size = self.sizes[chrom]
+        end = size if end is None else min(int(end), size)
+        start = max(int(start), 1)
+        end = max(end, start - 1)
+        offset = self.offsets[chrom]
+        return offset + start - 1, offset + end
+
+    def __len__(self):
+        return len(self.references)
+
+    def __repr__(self):
+        return f"PackedGenome({self.path}, {self.encoding}, {len(self)} chromosomes, {sum(self.lengths)} bases)"
+
+
+def kmer_names(k):
+    """
+    k-mer of every index of kmer_counts
+    """
+    index = np.arange(4 ** k)
+    digits = np.stack([(index >> (2 * (k - 1 - i))) & 3 for i in range(k)], axis=1)
+    return ["".join("ACGT"[digit] for digit in row) for row in digits.tolist()]
+
+
+def _kmer_index(codes, k, n):
+    """
+    base 4 index of the k-mers starting at the first n positions of codes and whether they are free of N, built from k
+    shifted slices so nothing of size n * k is allocated
+    """
+    index = np.zeros(n, dtype=np.int64)
+    for i in range(k):
+        index <<= 2
+        index |= codes[i:i + n] & 3
+    missing = np.concatenate([[0], np.cumsum(codes == N_CODE, dtype=np.int32)])
+    return index, missing[k:k + n] == missing[:n]
+
+
+def _pack(codes):
+    """
+    four 2 bit codes per byte, the first base in the high bits, N is stored as A
+    """
+    padded = np.zeros(-(-codes.shape[0] // 4) * 4, dtype=np.uint8)
+    padded[:codes.shape[0]] = codes & 3
+    padded = padded.reshape(-1, 4)
+    return (padded[:, 0] << 6) | (padded[:, 1] << 4) | (padded[:, 2] << 2) | padded[:, 3]
+
+
+def _unpack(packed):
+    packed = np.asarray(packed, dtype=np.uint8)
+    return np.stack([(packed >> 6) & 3, (packed >> 4) & 3, (packed >> 2) & 3, packed & 3], axis=1).reshape(-1)
+
+
+def _runs(mask):
+    """
+    0-based half open [start, end) runs of True in a boolean array
+    """
+    changes = np.diff(np.concatenate([[0], mask.view(np.int8), [0]]))
+    return np.flatnonzero(changes == 1).astype(np.int64), np.flatnonzero(changes == -1).astype(np.int64)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="build a memory mapped packed genome from a fasta file")
+    parser.add_argument("fasta", help="fasta file, indexed with samtools faidx or indexable by pysam")
+    parser.add_argument("output", help="directory to write the packed genome to")
+    parser.add_argument("--encoding", choices=ENCODINGS, default="uint8",
+                        help="one byte per base (region fetches are views) or four bases per byte")
+    args = parser.parse_args(args)
+    print(PackedGenome.build(args.fasta, args.output, encoding=args.encoding))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,24 @@
+import csv
+import gzip
+import io
+import itertools
+import os
+import re
+import threading
+import time
+import warnings
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
 import pandas as pd
+import sqlalchemy
 from tqdm import tqdm
 import json
 
+from benchmate.ranges.parallel import get_executor
+
 
 
 #TODO annotations matching
@@ -24,93 +41,258 @@ def parse_gtf_attributes(attributes_str):
             attributes[key] = value
     return attributes
 
-def parse_gtf(filepath):
-    gene_list = []
-    transcript_list = []
-    exon_list = []
-    cds_list = []
-    three_utr_list = []
-    five_utr_list = []
-
-    gene_fields=["gene_id"]
-    transcript_fields=["transcript_id", "gene_id"]
-    exon_fields=["exon_id", "exon_number", "transcript_id"]
-    coding_fields=["exon_number", "transcript_id"] # so I need to match this with the exon field
-    three_utr_fields=["transcript_id"]
-    five_utr_fields=["transcript_id"]
-
-    chrom_list=[]
-    with open(filepath, 'r') as gtf_file:
-        for line in tqdm(gtf_file, desc="Parsing GTF file", unit=" lines processed"):
-            if line.startswith('#') or not line.strip():
-                continue
-            fields = line.strip().split('\t')
-
-            if len(fields) != 9:
-                continue
-
-            fields = line.strip().split('\t')
-            chrom_name = fields[0]
-            if chrom_name not in chrom_list:
-                chrom_list.append(chrom_name)
-
-            feature_type = fields[2]
-            start = int(fields[3])
-            end = int(fields[4])
-            strand = fields[6]
-            phase = fields[7]
-            attributes_str = fields[8]
-            attributes = parse_gtf_attributes(attributes_str)
-            line={"chrom":chrom_name,
-                         "type":feature_type,
-                         "start":start,
-                         "end":end,
-                         "strand":strand,
-                         "phase":phase,
-                         "annotations":attributes
-                         }
-
-            if line["type"] == "gene":
-                gene_line=line
-                gene_line={key: gene_line[key] for key in ["chrom", "start", "end", "strand", "annotations"]}
-                for field in gene_fields:
-                    gene_line[field]=gene_line["annotations"][field]
-                gene_list.append(gene_line)
-            elif line["type"] == "transcript":
-                transcript_line=line
-                transcript_line = {key: transcript_line[key] for key in ["start", "end", "annotations"]}
-                for field in transcript_fields:
-                    transcript_line[field]=line["annotations"][field]
-                transcript_list.append(transcript_line)
-            elif line["type"] == "exon":
-                exon_line=line
-                exon_line = {key: exon_line[key] for key in ["start", "end", "annotations"]}
-                for field in exon_fields:
-                    exon_line[field]=line["annotations"][field]
-                exon_list.append(exon_line)
-            elif line["type"] == "CDS":
-                coding_line=line
-                coding_line = {key: coding_line[key] for key in ["start", "end", "annotations", "phase"]}
-                for field in coding_fields:
-                    coding_line[field]=line["annotations"][field]
-                cds_list.append(coding_line)
-            elif line["type"] == "three_prime_utr":
-                three_utr_line=line
-                three_utr_line = {key: three_utr_line[key] for key in ["start", "end", "annotations"]}
-                for field in three_utr_fields:
-                    three_utr_line[field]=line["annotations"][field]
-                three_utr_list.append(three_utr_line)
-            elif line["type"] == "five_prime_utr":
-                five_utr_line = line
-                five_utr_line = {key: five_utr_line[key] for key in ["start", "end", "annotations"]}
-                for field in five_utr_fields:
-                    five_utr_line[field] = line["annotations"][field]
-                five_utr_list.append(five_utr_line)
-            else:
-                continue
-
-    return (chrom_list, gene_list, transcript_list, exon_list, cds_list,
-            three_utr_list, five_utr_list)
+# gtf feature types that are imported, the table name, the gtf columns that are kept and the attributes that are
+# pulled out into their own columns, the full attributes are kept as json in the annotations column
+GTF_FEATURES = {"gene": ("gene", ["chrom", "start", "end", "strand"], ["gene_id"]),
+                "transcript": ("transcript", ["start", "end"], ["transcript_id", "gene_id"]),
+                "exon": ("exon", ["start", "end"], ["exon_id", "exon_number", "transcript_id"]),
+                "CDS": ("coding", ["start", "end", "phase"], ["exon_number", "transcript_id"]),
+                "three_prime_utr": ("three_utr", ["start", "end"], ["transcript_id"]),
+                "five_prime_utr": ("five_utr", ["start", "end"], ["transcript_id"])}
+
+GTF_COLUMNS = {"chrom": str, "source": str, "type": str, "start": "Int64", "end": "Int64", "score": str,
+               "strand": str, "phase": str, "attributes": str}
+
+# one key "value"; pair of the attributes column, values of numeric attributes like exon_number are not quoted
+GTF_ATTRIBUTE = r'\s*([^\s;"]+)\s+"?([^";]*)"?\s*(?:;|$)'
+# attribute strings made only of such pairs, the others (a ; inside quotes, a key without a value) are not rewritten
+GTF_ATTRIBUTES = rf'(?:{GTF_ATTRIBUTE})*\s*'
+
+def read_gtf_chunks(filepath, chunk_size=500000, n_jobs=None):
+    """
+    read a gtf file in chunks with a typed read_csv, attributes are extracted with vectorized regular expressions
+    instead of a dictionary per line so memory is bounded by the chunk size
+    :param filepath: path to the gtf file, can be gzipped
+    :param chunk_size: number of lines per chunk
+    :param n_jobs: parse the chunks in this many worker processes (or an Executor, see benchmate.ranges.parallel)
+        while the caller works on the ones already parsed, None parses them in this process
+    :return: generator of (chroms, features) in file order, chroms are the chromosome names of the chunk in order of
+        appearance and features is a dictionary of table name to a DataFrame for every feature type in GTF_FEATURES
+    """
+    executor, owned = get_executor(n_jobs)
+    # bounds the number of chunks held in memory when the caller is slower than the workers
+    ahead = 2 * (n_jobs if isinstance(n_jobs, int) else (os.cpu_count() or 1))
+    try:
+        with tqdm(desc="Parsing GTF file", unit=" lines processed") as progress:
+            pending = deque()
+            for lines, block in _gtf_blocks(filepath, chunk_size):
+                if executor is None:
+                    progress.update(lines)
+                    yield parse_gtf_block(block)
+                    continue
+                pending.append((lines, executor.submit(parse_gtf_block, block)))
+                if len(pending) >= ahead:
+                    lines, future = pending.popleft()
+                    progress.update(lines)
+                    yield future.result()
+            while pending:
+                lines, future = pending.popleft()
+                progress.update(lines)
+                yield future.result()
+    finally:
+        if owned:
+            executor.shutdown(cancel_futures=True)
+
+def _gtf_blocks(filepath, chunk_size):
+    """
+    the raw text of a gtf file in blocks of chunk_size lines
+    :return: generator of (number of lines, text)
+    """
+    opener = gzip.open if str(filepath).endswith(".gz") else open
+    with opener(filepath, "rt") as handle:
+        while True:
+            lines = list(itertools.islice(handle, chunk_size))
+            if not lines:
+                return
+            yield len(lines), "".join(lines)
+
+def parse_gtf_block(text):
+    """
+    parse a block of gtf lines, this is what the worker processes of read_gtf_chunks run
+    :return: chromosome names of the block and a dictionary of table name to DataFrame, see read_gtf_chunks
+    """
+    chunk = pd.read_csv(io.StringIO(text), sep="\t", header=None, names=list(GTF_COLUMNS.keys()), dtype=GTF_COLUMNS,
+                        usecols=range(len(GTF_COLUMNS)), quoting=csv.QUOTE_NONE, on_bad_lines="skip")
+    # comment lines only have a first column
+    chunk = chunk[chunk["attributes"].notna() & ~chunk["chrom"].str.startswith("#")]
+    features = {}
+    for feature, (table, columns, fields) in GTF_FEATURES.items():
+        features[table] = gtf_features(chunk[chunk["type"] == feature], columns, fields)
+    return pd.unique(chunk["chrom"]).tolist(), features
+
+def gtf_features(lines, columns, fields):
+    """
+    typed DataFrame for one feature type
+    :param lines: gtf lines of that feature type as read by read_gtf_chunks
+    :param columns: gtf columns to keep
+    :param fields: attributes to put in their own columns, exon_number is an integer and phase of the CDS too
+    :return: DataFrame with the columns, the attributes and annotations, a json string of all the attributes
+    """
+    features = lines[columns].reset_index(drop=True)
+    features["start"] = features["start"].astype("int64")
+    features["end"] = features["end"].astype("int64")
+    if "phase" in features.columns:
+        features["phase"] = pd.to_numeric(features["phase"], errors="coerce").astype("Int64")
+    attributes = lines["attributes"].reset_index(drop=True)
+    features["annotations"] = gtf_attributes_json(attributes)
+    for field in fields:
+        values = attributes.str.extract(rf'(?:^|;)\s*{re.escape(field)}\s+"?([^";]*)"?', expand=False)
+        if field == "exon_number":
+            values = pd.to_numeric(values, errors="coerce").astype("Int64")
+        features[field] = values
+    return features
+
+def gtf_attributes_json(attributes):
+    """
+    rewrite gtf attribute strings as json objects with string values in one vectorized pass, same result as
+    json.dumps(parse_gtf_attributes(...)) except that repeated keys (tag "basic"; tag "CCDS") are all kept, jsonb
+    keeps the last one like parse_gtf_attributes did. Strings the pattern does not fully cover would give invalid json
+    and are dumped from parse_gtf_attributes instead.
+    """
+    pairs = (attributes.str.replace("\\", "\\\\", regex=False)
+             .str.replace(GTF_ATTRIBUTE, r'"\1": "\2", ', regex=True)
+             .str.rstrip(", "))
+    annotations = "{" + pairs + "}"
+    irregular = ~attributes.str.fullmatch(GTF_ATTRIBUTES).astype(bool)
+    if irregular.any():
+        annotations[irregular] = attributes[irregular].map(lambda value: json.dumps(parse_gtf_attributes(value)))
+    return annotations
+
+def parse_gtf(filepath, chunk_size=500000):
+    """
+    read the gene models in a gtf file, see read_gtf_chunks
+    :return: chromosome names and DataFrames of genes, transcripts, exons, cds, three and five prime utrs
+    """
+    chrom_list = {}
+    parts = {table: [] for table, _, _ in GTF_FEATURES.values()}
+    for chroms, features in read_gtf_chunks(filepath, chunk_size):
+        chrom_list.update(dict.fromkeys(chroms))
+        for table, values in features.items():
+            parts[table].append(values)
+    tables = {table: pd.concat(values, ignore_index=True) if len(values) > 0 else pd.DataFrame()
+              for table, values in parts.items()}
+    return (list(chrom_list.keys()), tables["gene"], tables["transcript"], tables["exon"], tables["coding"],
+            tables["three_utr"], tables["five_utr"])
+
+def _annotations_json(annotations):
+    """
+    annotations as json strings, parse_gtf already returns them that way, dictionaries are dumped
+    """
+    return annotations.map(lambda value: value if isinstance(value, str) else json.dumps(value, ensure_ascii=False))
+
+def bulk_insert(df, table, engine, batch_size=100000):
+    """
+    append a DataFrame to an existing table. On PostgreSQL the rows are streamed with COPY ... FROM STDIN in csv
+    format, other databases get executemany in batches of batch_size rows, both in a single transaction.
+    :param df: DataFrame whose columns are named like the table columns
+    :param table: table name
+    :param engine: sqlalchemy engine
+    :param batch_size: rows per COPY or executemany call, bounds the size of the buffers
+    """
+    if df.empty:
+        return
+    columns = [engine.dialect.identifier_preparer.quote(column) for column in df.columns]
+    if engine.dialect.name == "postgresql":
+        connection = engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            if hasattr(cursor, "copy_expert"):
+                sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)"
+                for start in range(0, df.shape[0], batch_size):
+                    buffer = io.StringIO()
+                    # missing values are written as unquoted empty fields which COPY reads as NULL
+                    df.iloc[start:start + batch_size].to_csv(buffer, index=False, header=False)
+                    buffer.seek(0)
+                    cursor.copy_expert(sql, buffer)
+                connection.commit()
+                return
+        finally:
+            connection.close()
+
+    statement = sqlalchemy.table(table, *[sqlalchemy.column(column) for column in df.columns]).insert()
+    with engine.begin() as connection:
+        for start in range(0, df.shape[0], batch_size):
+            batch = df.iloc[start:start + batch_size].astype(object)
+            connection.execute(statement, batch.where(batch.notna(), None).to_dict("records"))
+
+# UCSC binning scheme, a feature goes in the smallest bin that contains it, bins are 128kb, 1Mb, 8Mb, 64Mb and 512Mb.
+# Coordinates past 512Mb use the extended scheme with an extra 4Gb level, its bins are numbered from BIN_EXTENDED_OFFSET.
+BIN_OFFSETS = [512 + 64 + 8 + 1, 64 + 8 + 1, 8 + 1, 1, 0]
+BIN_OFFSETS_EXTENDED = [4096 + 512 + 64 + 8 + 1, 512 + 64 + 8 + 1, 64 + 8 + 1, 8 + 1, 1, 0]
+BIN_FIRST_SHIFT = 17
+BIN_NEXT_SHIFT = 3
+BIN_EXTENDED_OFFSET = 4681
+BIN_STANDARD_MAX = 2 ** 29
+
+
+def ucsc_bins(starts, ends):
+    """
+    bin of every 1-based inclusive [start, end] feature, stored in the bin column of the annotation tables
+    :return: int64 array
+    """
+    starts = np.asarray(starts, dtype=np.int64) - 1
+    ends = np.asarray(ends, dtype=np.int64)
+    extended = ends > BIN_STANDARD_MAX
+    bins = np.full(starts.shape[0], -1, dtype=np.int64)
+    for offsets, rows, base in [(BIN_OFFSETS, ~extended, 0), (BIN_OFFSETS_EXTENDED, extended, BIN_EXTENDED_OFFSET)]:
+        start_bin = starts[rows] >> BIN_FIRST_SHIFT
+        end_bin = (np.maximum(ends[rows], starts[rows] + 1) - 1) >> BIN_FIRST_SHIFT
+        level_bins = np.full(start_bin.shape[0], -1, dtype=np.int64)
+        for offset in offsets:
+            found = (level_bins < 0) & (start_bin == end_bin)
+            level_bins[found] = base + offset + start_bin[found]
+            start_bin >>= BIN_NEXT_SHIFT
+            end_bin >>= BIN_NEXT_SHIFT
+        bins[rows] = level_bins
+    return bins
+
+
+def overlapping_bins(start, end):
+    """
+    every bin that can hold a feature overlapping the 1-based inclusive region [start, end], a range query only has to
+    look at rows with these bins. Extended bins are always included, features that end past 512Mb can overlap a region
+    that does not.
+    :return: list of bin numbers
+    """
+    start, end = int(start) - 1, int(end)
+    schemes = [(BIN_OFFSETS_EXTENDED, BIN_EXTENDED_OFFSET, end)]
+    if start < BIN_STANDARD_MAX:
+        schemes.insert(0, (BIN_OFFSETS, 0, min(end, BIN_STANDARD_MAX)))
+    bins = []
+    for offsets, base, region_end in schemes:
+        start_bin = start >> BIN_FIRST_SHIFT
+        end_bin = (max(region_end, start + 1) - 1) >> BIN_FIRST_SHIFT
+        for offset in offsets:
+            bins.extend(range(base + offset + start_bin, base + offset + end_bin + 1))
+            start_bin >>= BIN_NEXT_SHIFT
+            end_bin >>= BIN_NEXT_SHIFT
+    return bins
+
+
+def reserve_ids(table, n, engine, column="id"):
+    """
+    reserve n primary keys of a table so that rows and the foreign keys pointing at them can be built before anything
+    is written, instead of inserting and reading the generated ids back. On PostgreSQL the ids are taken from the
+    serial sequence of the column so concurrent writers never get the same ones, elsewhere they continue from the
+    current maximum which assumes a single writer (always true for SQLite).
+    :param table: table name
+    :param n: number of ids
+    :param engine: sqlalchemy engine
+    :param column: autoincrement primary key column
+    :return: int64 array of n increasing ids
+    """
+    if n == 0:
+        return np.empty(0, dtype=np.int64)
+    with engine.begin() as connection:
+        if engine.dialect.name == "postgresql":
+            ids = connection.execute(sqlalchemy.text(
+                "select nextval(pg_get_serial_sequence(:table, :column)) from generate_series(1, :n)"),
+                {"table": table, "column": column, "n": int(n)}).scalars().all()
+            return np.sort(np.asarray(ids, dtype=np.int64))
+        quote = engine.dialect.identifier_preparer.quote
+        start = connection.execute(sqlalchemy.text(
+            f"select coalesce(max({quote(column)}), 0) from {quote(table)}")).scalar()
+    return np.arange(int(start) + 1, int(start) + 1 + n, dtype=np.int64)
 
 def start_genome(genome_name, genome_fasta_file, engine, transcriptome_fasta_file=None,
                  proteome_fasta_file=None, description=None):
@@ -119,118 +301,326 @@ def start_genome(genome_name, genome_fasta_file, engine, transcriptome_fasta_fil
                             "transcriptome_fasta_file":[transcriptome_fasta_file],
                             "proteome_fasta_file":[proteome_fasta_file],
                             "description":[description],})
-    df_genome.to_sql("genome", if_exists='append', index=False, con=engine)
-    genome_id = pd.read_sql(
-        f"select id from genome where genome_name=\'{df_genome['genome_name'].tolist()[0]}\'",
-        con=engine)
-    genome_id=genome_id["id"].tolist()[0]
+    df_genome.insert(0, "id", reserve_ids("genome", 1, engine))
+    bulk_insert(df_genome, "genome", engine)
+    genome_id=int(df_genome["id"].tolist()[0])
     return genome_id
 
+# the insert functions assign the primary keys themselves (see reserve_ids) and return the id mappings the child tables
+# need, nothing is read back from the database
+
 def insert_chroms(genome_id, chrom_list, engine):
     chrom_df=pd.DataFrame({"chrom":chrom_list})
     chrom_df["genome_id"]=genome_id
-    chrom_df.to_sql("chrom", con=engine, if_exists='append', index=False)
-    chrom_ids = pd.read_sql(f"select id, chrom from chrom where genome_id='{genome_id}'", con=engine)
+    chrom_df.insert(0, "id", reserve_ids("chrom", chrom_df.shape[0], engine))
+    bulk_insert(chrom_df, "chrom", engine)
+    chrom_ids = chrom_df[["id", "chrom"]]
     return chrom_ids
 
 def insert_genes(chrom_ids, gene_list, engine):
     genes=pd.DataFrame(gene_list)
     genes=genes.merge(chrom_ids, on="chrom", how="left").drop(columns=["chrom"]).rename(columns={"id":"chrom_id"})
-    genes['annotations'] = genes['annotations'].apply(lambda x: json.dumps(x, ensure_ascii=False))
-    genes.to_sql("gene", con=engine, if_exists='append', index=False)
-    gene_ids=pd.read_sql(
-        f"select id, gene_id from gene where chrom_id in ({','.join(chrom_ids['id'].astype(str).tolist())})",
-        con=engine)
+    genes['annotations'] = _annotations_json(genes['annotations'])
+    genes.insert(0, "id", reserve_ids("gene", genes.shape[0], engine))
+    genes["bin"]=ucsc_bins(genes["start"], genes["end"])
+    bulk_insert(genes, "gene", engine)
+    gene_ids=genes[["id", "gene_id"]]
     return gene_ids
 
 def insert_transcripts(gene_ids, tx_list, engine):
     transcripts=pd.DataFrame(tx_list)
     transcripts=transcripts.merge(gene_ids, on="gene_id", how="left").drop(columns=["gene_id"]).rename(columns={"id":"gene_id"})
-    transcripts['annotations'] = transcripts['annotations'].apply(lambda x: json.dumps(x, ensure_ascii=False))
-    transcripts.to_sql("transcript", if_exists='append', index=False, con=engine)
-    transcript_ids = pd.read_sql(
-        f"select id, transcript_id from transcript where gene_id in ({','.join(gene_ids['id'].astype(str).tolist())})",
-        con=engine)
+    transcripts['annotations'] = _annotations_json(transcripts['annotations'])
+    transcripts.insert(0, "id", reserve_ids("transcript", transcripts.shape[0], engine))
+    transcripts["bin"]=ucsc_bins(transcripts["start"], transcripts["end"])
+    bulk_insert(transcripts, "transcript", engine)
+    transcript_ids = transcripts[["id", "transcript_id"]]
     return transcript_ids
 
 def insert_exons(transcript_ids, exon_list, engine):
     exons=pd.DataFrame(exon_list)
     exons=exons.merge(transcript_ids, on="transcript_id", how="left").drop(columns=["transcript_id"]).rename(columns={"id":"transcript_id"})
-    exons['annotations'] = exons['annotations'].apply(lambda x: json.dumps(x, ensure_ascii=False))
-    exons.to_sql("exon", con=engine, if_exists='append', index=False)
-    exon_ids = pd.read_sql(f"select id, exon_number, transcript_id from exon where transcript_id in ({','.join(transcript_ids['id'].astype(str).tolist())})", con=engine)
+    exons['annotations'] = _annotations_json(exons['annotations'])
+    exons.insert(0, "id", reserve_ids("exon", exons.shape[0], engine))
+    exons["bin"]=ucsc_bins(exons["start"], exons["end"])
+    bulk_insert(exons, "exon", engine)
+    exon_ids = exons[["id", "exon_number", "transcript_id"]]
     return exon_ids
 
 def insert_three_utrs(transcript_ids, three_utr_list, engine):
     three_utrs=pd.DataFrame(three_utr_list)
     if not three_utrs.empty:
         three_utrs=three_utrs.merge(transcript_ids, on="transcript_id", how="left").drop(columns=["transcript_id"]).rename(columns={"id":"transcript_id"})
-        three_utrs['annotations'] = three_utrs['annotations'].apply(lambda x: json.dumps(x, ensure_ascii=False))
-        three_utrs.to_sql("three_utr", con=engine, if_exists='append', index=False)
+        three_utrs['annotations'] = _annotations_json(three_utrs['annotations'])
+        three_utrs["bin"]=ucsc_bins(three_utrs["start"], three_utrs["end"])
+        bulk_insert(three_utrs, "three_utr", engine)
 
 def insert_five_utrs(transcript_ids, five_utr_list, engine):
     five_utrs = pd.DataFrame(five_utr_list)
     if not five_utrs.empty:
         five_utrs = five_utrs.merge(transcript_ids, on="transcript_id", how="left").drop(columns=["transcript_id"]).rename(columns={"id":"transcript_id"})
-        five_utrs['annotations'] = five_utrs['annotations'].apply(lambda x: json.dumps(x, ensure_ascii=False))
-        five_utrs.to_sql("five_utrs", con=engine, if_exists='append', index=False)
+        five_utrs['annotations'] = _annotations_json(five_utrs['annotations'])
+        five_utrs["bin"]=ucsc_bins(five_utrs["start"], five_utrs["end"])
+        bulk_insert(five_utrs, "five_utr", engine)
 
 def insert_coding(transcript_ids, exon_ids, coding_list, engine):
     coding=pd.DataFrame(coding_list)
     coding=coding.merge(transcript_ids, on="transcript_id", how="left").rename(columns={"transcript_id":"transcript_name", "id":"transcript_id"})
-    coding=coding.merge(exon_ids[["transcript_id", "id"]], on="transcript_id", how="left").drop(columns=["transcript_id", "exon_number"]).rename(columns={"id":"exon_id"})
-    coding['annotations'] = coding['annotations'].apply(lambda x: json.dumps(x, ensure_ascii=False))
+    # exon_number is an integer on both sides so each CDS gets the id of its own exon
+    coding["exon_number"]=coding["exon_number"].astype("Int64")
+    exon_ids=exon_ids[["transcript_id", "exon_number", "id"]].astype({"exon_number": "Int64"})
+    coding=coding.merge(exon_ids, on=["transcript_id", "exon_number"], how="left").drop(columns=["transcript_id", "exon_number"]).rename(columns={"id":"exon_id"})
+    coding['annotations'] = _annotations_json(coding['annotations'])
     coding=coding.drop(columns=["transcript_name"])
-    coding.to_sql("coding", con=engine, if_exists='append', index=False)
+    coding["bin"]=ucsc_bins(coding["start"], coding["end"])
+    bulk_insert(coding, "coding", engine)
 
 def insert_introns(transcript_ids, exon_list, engine):
-    exons=pd.DataFrame(exon_list).merge(transcript_ids, on="transcript_id", how="left").\
-        drop(columns=["transcript_id"]).rename(columns={"id":"transcript_id"}).groupby(["transcript_id"])
-    introns=[]
-    for tx, data in exons:
-        data=data.sort_values(by=["exon_number"])
-        for i in range(data.shape[0] - 1):
-            exon1_start, exon1_end = data.iloc[i].start, data.iloc[i].end
-            exon2_start, exon2_end = data.iloc[i + 1].start, data.iloc[i + 1].end
-            intron_start = exon1_end + 1
-            intron_end = exon2_start - 1
-            if intron_start < intron_end:  # the transcript is on the + strand
-                introns.append({
-                    'transcript_id': tx[0], 'intron_rank': i + 1,
-                    'start': intron_start, 'end': intron_end
-                })
-            else:  # on the - strand
-                introns.append({
-                    'transcript_id': tx[0], 'intron_rank': i + 1,
-                    'start': intron_end, 'end': intron_end
-                })
-    introns=pd.DataFrame(introns)
+    """
+    derive the introns from the gaps between consecutive exons of each transcript in one pass over the exons sorted by
+    transcript and exon number. Exon numbers follow the transcript so on the - strand they go down the genome, the
+    intron between two exons is always from the lower end + 1 to the higher start - 1. Adjacent exons without a gap
+    do not give an intron.
+    :param transcript_ids: DataFrame of transcript database ids (id) and transcript_id
+    :param exon_list: exons with transcript_id, exon_number, start and end, exons of transcripts that are not in
+        transcript_ids are left out with a warning
+    """
+    exons=pd.DataFrame(exon_list)[["transcript_id", "exon_number", "start", "end"]].merge(
+        transcript_ids, on="transcript_id", how="left")
+    missing=exons["id"].isna()
+    if missing.any():
+        warnings.warn(f"{int(missing.sum())} exon rows refer to transcripts that are not in the database, they are "
+                      f"left out of the introns")
+        exons=exons[~missing]
+    exons=exons.sort_values(["id", "exon_number"], kind="stable")
+    tx=exons["id"].to_numpy(dtype=np.int64)
+    starts=exons["start"].to_numpy(dtype=np.int64)
+    ends=exons["end"].to_numpy(dtype=np.int64)
+    # position of each exon within its transcript, the intron rank is that of the exon before it
+    first=np.ones(tx.shape[0], dtype=bool)
+    first[1:]=tx[1:] != tx[:-1]
+    rank=np.arange(tx.shape[0]) - np.maximum.accumulate(np.where(first, np.arange(tx.shape[0]), 0))
+
+    same=~first[1:]
+    intron_starts=np.minimum(ends[:-1], ends[1:])[same] + 1
+    intron_ends=np.maximum(starts[:-1], starts[1:])[same] - 1
+    introns=pd.DataFrame({"transcript_id": tx[:-1][same], "intron_rank": rank[:-1][same] + 1,
+                          "start": intron_starts, "end": intron_ends})
+    introns=introns[introns["start"] <= introns["end"]]
     introns["annotations"]= '{}'
-    #introns['annotations'] = introns['annotations'].apply(lambda x: json.dumps(x, ensure_ascii=False))
     if not introns.empty:
-        introns.to_sql("intron", con=engine, if_exists='append', index=False)
+        introns["bin"]=ucsc_bins(introns["start"], introns["end"])
+        bulk_insert(introns, "intron", engine)
+
+
+class StageTimer:
+    def __init__(self):
+        """
+        wall clock seconds per import stage, stages that run in different threads are added up separately so their sum
+        can be more than the total time
+        """
+        self.seconds = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def time(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.seconds[stage] = self.seconds.get(stage, 0.0) + time.perf_counter() - start
+
+    def __str__(self):
+        return ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in self.seconds.items())
+
+
+class GenomeLoader:
+    def __init__(self, genome_id, engine, writers=3, strict=False):
+        """
+        streaming version of the insert functions, chunks of a parsed gtf are written as they arrive. Chromosomes,
+        genes, transcripts and exons are written in order by the caller since their ids are needed for the next
+        table, the leaf tables (utrs, cds and introns) nothing points to are handed to a pool of writer threads, each
+        with its own connection. Rows whose parent has not been seen yet (a transcript before its gene) wait for the
+        next chunks, the ones that never find it are counted in skipped and left out.
+        :param genome_id: id from start_genome
+        :param engine: sqlalchemy engine
+        :param writers: number of writer threads for the leaf tables, only used on PostgreSQL, other databases
+            (SQLite) write everything from the calling thread
+        :param strict: raise a ValueError in finish if any rows refer to parents that are not in the gtf file instead of
+            leaving them out with a warning
+        """
+        self.genome_id = genome_id
+        self.engine = engine
+        self.timer = StageTimer()
+        self.writers = None
+        if writers > 0 and engine.dialect.name == "postgresql":
+            self.writers = ThreadPoolExecutor(max_workers=writers)
+        self.writes = []
+        self.strict = strict
+        self.skipped = {}
+        self.chrom_ids = pd.DataFrame({"id": pd.Series(dtype="int64"), "chrom": pd.Series(dtype=object)})
+        self.gene_ids = []
+        self.transcript_ids = []
+        self.exon_ids = []
+        self.exons = []
+        self.pending = {}
+
+    def add(self, chroms, features):
+        """
+        write one chunk from read_gtf_chunks
+        """
+        self.check()
+        known = set(self.chrom_ids["chrom"])
+        new_chroms = [chrom for chrom in chroms if chrom not in known]
+        if new_chroms:
+            with self.timer.time("chrom"):
+                self.chrom_ids = pd.concat([self.chrom_ids, insert_chroms(self.genome_id, new_chroms, self.engine)],
+                                           ignore_index=True)
+
+        genes = self._ready("gene", features["gene"], ["chrom"], self.chrom_ids[["chrom"]])
+        if not genes.empty:
+            with self.timer.time("gene"):
+                self.gene_ids.append(insert_genes(self.chrom_ids, genes, self.engine))
+
+        gene_ids = self._ids(self.gene_ids, "gene_id")
+        transcripts = self._ready("transcript", features["transcript"], ["gene_id"], gene_ids[["gene_id"]])
+        if not transcripts.empty:
+            with self.timer.time("transcript"):
+                self.transcript_ids.append(insert_transcripts(gene_ids, transcripts, self.engine))
+
+        transcript_ids = self._ids(self.transcript_ids, "transcript_id")
+        exons = self._ready("exon", features["exon"], ["transcript_id"], transcript_ids[["transcript_id"]])
+        if not exons.empty:
+            with self.timer.time("exon"):
+                exon_ids = insert_exons(transcript_ids, exons, self.engine)
+            self.exon_ids.append(exon_ids.merge(transcript_ids.rename(columns={"id": "transcript_id",
+                                                                              "transcript_id": "transcript_name"}),
+                                                on="transcript_id"))
+            self.exons.append(exons[["transcript_id", "exon_number", "start", "end"]])
+
+        for table, insert in [("three_utr", insert_three_utrs), ("five_utr", insert_five_utrs)]:
+            rows = self._ready(table, features[table], ["transcript_id"], transcript_ids[["transcript_id"]])
+            if not rows.empty:
+                self._write(table, insert, transcript_ids, rows, self.engine)
+
+        exon_ids = self._ids(self.exon_ids, "id")
+        coding = self._ready("coding", features["coding"], ["transcript_id", "exon_number"],
+                             exon_ids[["transcript_name", "exon_number"]].rename(
+                                 columns={"transcript_name": "transcript_id"}))
+        if not coding.empty:
+            self._write("coding", insert_coding, transcript_ids, exon_ids, coding, self.engine)
+
+    def finish(self):
+        """
+        write the introns, wait for the writer threads and report the rows that never found their parent
+        :return: chrom ids, like insert_chroms
+        """
+        try:
+            if self.exons:
+                self._write("intron", insert_introns, self._ids(self.transcript_ids, "transcript_id"),
+                            pd.concat(self.exons, ignore_index=True), self.engine)
+            for write in self.writes:
+                write.result()
+        except BaseException:
+            self.abort()
+            raise
+        if self.writers is not None:
+            self.writers.shutdown()
+        self.skipped = {table: rows.shape[0] for table, rows in self.pending.items() if not rows.empty}
+        if self.skipped:
+            message = ", ".join(f"{count} {table}" for table, count in self.skipped.items())
+            if self.strict:
+                raise ValueError(f"rows refer to parents that are not in the gtf file: {message}")
+            warnings.warn(f"rows refer to parents that are not in the gtf file and are not imported: {message}")
+        return self.chrom_ids
+
+    def check(self):
+        """
+        raise the error of the first leaf table write that failed, so the import stops at the next chunk instead of
+        after the whole file
+        """
+        for write in [write for write in self.writes if write.done()]:
+            write.result()
+            self.writes.remove(write)
+
+    def abort(self):
+        """
+        cancel the leaf table writes that have not started and wait for the running ones
+        """
+        for write in self.writes:
+            write.cancel()
+        if self.writers is not None:
+            self.writers.shutdown(wait=True, cancel_futures=True)
+
+    def _ready(self, table, rows, key, known):
+        """
+        rows of a chunk, plus the ones left over from earlier chunks, whose parent key is in known, the rest is kept
+        for later
+        """
+        if table in self.pending:
+            rows = pd.concat([self.pending.pop(table), rows], ignore_index=True)
+        if rows.empty:
+            return rows
+        found = pd.MultiIndex.from_frame(rows[key]).isin(pd.MultiIndex.from_frame(known[key]))
+        if not found.all():
+            self.pending[table] = rows[~found].reset_index(drop=True)
+        return rows[found].reset_index(drop=True)
+
+    def _ids(self, parts, column):
+        # id mappings of the chunks written so far, concatenated once per chunk
+        if len(parts) > 1:
+            parts[:] = [pd.concat(parts, ignore_index=True)]
+        if not parts:
+            return pd.DataFrame({"id": pd.Series(dtype="int64"), column: pd.Series(dtype=object)})
+        return parts[0]
+
+    def _write(self, table, insert, *args):
+        def run():
+            with self.timer.time(table):
+                insert(*args)
+        if self.writers is None:
+            run()
+        else:
+            self.writes.append(self.writers.submit(run))
 
 
 def insert_genome(gtf, engine, name, description, genome_fasta,
-                  transcriptome_fasta=None, proteome_fasta=None):
+                  transcriptome_fasta=None, proteome_fasta=None, n_jobs=None, writers=3, chunk_size=500000,
+                  strict=False):
+    """
+    import a gtf file into the genome tables. The file is parsed in chunks, with n_jobs the chunks are parsed in
+    worker processes while the ones before them are being written, see read_gtf_chunks and GenomeLoader. A failed
+    write stops the parsing and the other writes, tables written before it are not rolled back.
+    Transcripts, exons, cds and utrs whose gene or transcript is not in the file are left out with a warning giving
+    their number per table, with strict a ValueError is raised instead (after the rest has been written).
+    :param n_jobs: number of parser processes, None parses in this process
+    :param writers: number of threads that write the utr, cds and intron tables on PostgreSQL
+    :param chunk_size: number of gtf lines per chunk
+    :param strict: raise for rows whose parent is not in the gtf file instead of leaving them out
+    :return: genome id and the chrom ids
+    """
+    start = time.perf_counter()
     print("Initializing genome database")
     genome_id=start_genome(genome_name=name, genome_fasta_file=genome_fasta,
                            engine=engine, transcriptome_fasta_file=transcriptome_fasta,
                            proteome_fasta_file=proteome_fasta, description=description)
-    print("Readig GTF file")
-    chrom_list, gene_list, transcript_list, exon_list, cds_list, three_utr_list, five_utr_list = parse_gtf(gtf)
-    print("Inserting genome data into database")
-    chrom_ids=insert_chroms(genome_id, chrom_list, engine)
-    gene_ids=insert_genes(chrom_ids, gene_list, engine)
-    transcript_ids=insert_transcripts(gene_ids, transcript_list, engine)
-    exon_ids=insert_exons(transcript_ids, exon_list, engine)
-    insert_three_utrs(transcript_ids, three_utr_list, engine)
-    insert_five_utrs(transcript_ids, five_utr_list, engine)
-    insert_coding(transcript_ids, exon_ids, cds_list, engine)
-    insert_introns(transcript_ids, exon_list, engine)
-    print("Finished genome database")
+    print("Reading GTF file and inserting genome data into database")
+    loader = GenomeLoader(genome_id, engine, writers=writers, strict=strict)
+    chunks = read_gtf_chunks(gtf, chunk_size=chunk_size, n_jobs=n_jobs)
+    try:
+        while True:
+            # time spent waiting for the parser, with n_jobs most of the parsing overlaps with the writes
+            with loader.timer.time("parse"):
+                chunk = next(chunks, None)
+            if chunk is None:
+                break
+            loader.add(*chunk)
+    except BaseException:
+        # closing the generator shuts down the parser processes
+        chunks.close()
+        loader.abort()
+        raise
+    chrom_ids = loader.finish()
+    print(f"Finished genome database in {time.perf_counter() - start:.2f}s ({loader.timer})")
     return genome_id, chrom_ids
-
-
-
-
@@ -163,7 +163,9 @@ class Gene(Base):
     start = Column(Integer, nullable=False)
     end = Column(Integer, nullable=False)
     strand = Column(String, nullable=False)
+    bin = Column(Integer, nullable=True) # UCSC bin, see benchmate.genome.utils.ucsc_bins
     annotations=Column(JSONB)
+    __table_args__ = (Index('ix_gene_range', 'chrom_id', 'bin', 'start'),)
 
 class Transcript(Base):
     __tablename__ = 'transcript'
@@ -172,7 +174,9 @@ class Transcript(Base):
     start = Column(Integer, nullable=False)
     end = Column(Integer, nullable=False)
     gene_id=Column(Integer, ForeignKey('gene.id'))
+    bin = Column(Integer, nullable=True)
     annotations=Column(JSONB)
+    __table_args__ = (Index('ix_transcript_range', 'bin', 'start'),)
 
 class Exon(Base):
     __tablename__ = 'exon'
@@ -182,7 +186,9 @@ class Exon(Base):
     end = Column(Integer, nullable=False)
     exon_number = Column(Integer, nullable=False)
     transcript_id=Column(Integer, ForeignKey('transcript.id'), nullable=False)
+    bin = Column(Integer, nullable=True)
     annotations = Column(JSONB)
+    __table_args__ = (Index('ix_exon_range', 'bin', 'start'),)
 
 class ThreeUTR(Base):
     __tablename__ = 'three_utr'
@@ -190,7 +196,9 @@ class ThreeUTR(Base):
     start = Column(Integer, nullable=False)
     end = Column(Integer, nullable=False)
     transcript_id = Column(Integer, ForeignKey('transcript.id'), nullable=True)
+    bin = Column(Integer, nullable=True)
     annotations = Column(JSONB)
+    __table_args__ = (Index('ix_three_utr_range', 'bin', 'start'),)
 
 class FiveUTR(Base):
     __tablename__ = 'five_utr'
@@ -198,7 +206,9 @@ class FiveUTR(Base):
     start = Column(Integer, nullable=False)
     end = Column(Integer, nullable=False)
     transcript_id = Column(Integer, ForeignKey('transcript.id'), nullable=True)
+    bin = Column(Integer, nullable=True)
     annotations = Column(JSON)
+    __table_args__ = (Index('ix_five_utr_range', 'bin', 'start'),)
 
 class Cds(Base):
     __tablename__ = 'coding'
@@ -208,7 +218,9 @@ class Cds(Base):
     end = Column(Integer, nullable=False)
     phase=Column(Integer, nullable=False)
     exon_id = Column(Integer, ForeignKey('exon.id'), nullable=False)
+    bin = Column(Integer, nullable=True)
     annotations = Column(JSONB)
+    __table_args__ = (Index('ix_coding_range', 'bin', 'start'),)
 
 class Introns(Base):
     __tablename__ = 'intron'
@@ -217,7 +229,9 @@ class Introns(Base):
     intron_rank = Column(Integer, nullable=False)
     start=Column(Integer)
     end=Column(Integer)
+    bin = Column(Integer, nullable=True)
     annotations = Column(JSONB)
+    __table_args__ = (Index('ix_intron_range', 'bin', 'start'),)
 
 # sequence tables
 class Sequence(Base):
@@ -0,0 +1,210 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from benchmate.ranges.genomicranges import GenomicRanges
+from benchmate.ranges.io import save_ranges, load_ranges
+from benchmate.ranges.overlaps import OVERLAP_TYPES
+
+# Benchmarks for the ranges module on synthetic interval sets, run with
+#   python -m benchmate.ranges.benchmark --sizes 1e3 1e5 1e7 --output results.json
+# and compare two runs (e.g. two commits) with
+#   python -m benchmate.ranges.benchmark --compare old.json new.json
+
+# GRCh38 primary chromosome sizes, intervals are spread over them in proportion to their size
+CHROM_SIZES = {"chr1": 248956422, "chr2": 242193529, "chr3": 198295559, "chr4": 190214555, "chr5": 181538259,
+               "chr6": 170805979, "chr7": 159345973, "chr8": 145138636, "chr9": 138394717, "chr10": 133797422,
+               "chr11": 135086622, "chr12": 133275309, "chr13": 114364328, "chr14": 107043718, "chr15": 101991189,
+               "chr16": 90338345, "chr17": 83257441, "chr18": 80373285, "chr19": 58617616, "chr20": 64444167,
+               "chr21": 46709983, "chr22": 50818468, "chrX": 156040895, "chrY": 57227415}
+
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+
+
+def synthetic_ranges(n, seed=0, chrom_sizes=None, median_width=300):
+    """
+    reproducible random intervals, chromosomes are picked in proportion to their size and widths are log normal like
+    exons or peaks
+    :param n: number of intervals
+    :param seed: random seed, the same seed always gives the same intervals
+    :param chrom_sizes: dictionary of chromosome sizes, defaults to CHROM_SIZES
+    :param median_width: median interval width
+    :return: chrom names, starts, ends and strands as numpy arrays
+    """
+    chrom_sizes = CHROM_SIZES if chrom_sizes is None else chrom_sizes
+    rng = np.random.default_rng(seed)
+    names = np.asarray(list(chrom_sizes.keys()), dtype=object)
+    sizes = np.asarray(list(chrom_sizes.values()), dtype=np.int64)
+    codes = rng.choice(names.shape[0], size=n, p=sizes / sizes.sum())
+    widths = np.minimum(np.round(rng.lognormal(np.log(median_width), 0.8, size=n)).astype(np.int64) + 1,
+                        sizes[codes])
+    starts = (rng.random(n) * (sizes[codes] - widths + 1)).astype(np.int64) + 1
+    strands = rng.choice(np.array(["+", "-"], dtype=object), size=n)
+    return names[codes], starts, starts + widths - 1, strands
+
+
+def workloads(n, seed=0):
+    """
+    the benchmarked operations for n intervals, queries and subjects are two independent sets of n intervals
+    :return: list of (name, setup, run), setup() builds the inputs outside the timed region and run(inputs) is timed
+    """
+    chroms, starts, ends, strands = synthetic_ranges(n, seed)
+    query = GenomicRanges(chroms, starts, ends, strands)
+    subject = GenomicRanges(*synthetic_ranges(n, seed + 1))
+
+    def indexed_subject():
+        indexed = subject[:]
+        indexed.overlap_index()
+        return indexed
+
+    def saved():
+        path = tempfile.mkdtemp()
+        save_ranges(query, path)
+        return path
+
+    def load(path):
+        loaded = load_ranges(path)
+        # touch the mapped columns so the read is part of the timing
+        return int(loaded.starts.sum()) + int(loaded.ends.sum())
+
+    tasks = [("construction", lambda: None, lambda _: GenomicRanges(chroms, starts, ends, strands)),
+             ("overlap_index", lambda: subject[:], lambda fresh: fresh.overlap_index())]
+    # the index of the subject is built in setup so these time the queries only
+    for type in OVERLAP_TYPES:
+        tasks.append((f"overlap_{type}", indexed_subject,
+                      lambda indexed, type=type: query.find_overlaps(indexed, type=type)))
+    tasks += [("coverage", lambda: None, lambda _: query.coverage(rle=True)),
+              ("reduce", lambda: None, lambda _: query.reduce()),
+              ("nearest", indexed_subject, lambda indexed: query.nearest(indexed)),
+              ("save", tempfile.mkdtemp, lambda path: save_ranges(query, path)),
+              ("load", saved, load)]
+    return tasks
+
+
+def measure(setup, run, repeat=3):
+    """
+    time run(setup()) repeat times, then once more under tracemalloc for the peak memory the run allocates. numpy
+    reports its buffers to tracemalloc so this includes the arrays, memory mapped files are not counted.
+    :return: dictionary with the timings in seconds and the peak in bytes
+    """
+    times = []
+    for _ in range(repeat):
+        inputs = setup()
+        start = time.perf_counter()
+        run(inputs)
+        times.append(time.perf_counter() - start)
+        _cleanup(inputs)
+
+    inputs = setup()
+    tracemalloc.start()
+    try:
+        run(inputs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        _cleanup(inputs)
+    return {"min": min(times), "median": float(np.median(times)), "times": times, "peak_memory": peak}
+
+
+def run_benchmarks(sizes=None, repeat=3, seed=0, only=None, verbose=True):
+    """
+    run every workload for every size
+    :param sizes: list of numbers of intervals, defaults to DEFAULT_SIZES
+    :param repeat: number of timed runs per workload
+    :param seed: random seed of the synthetic data
+    :param only: optional list of workload names to run
+    :return: dictionary with the environment and one result per workload and size, see write_results
+    """
+    sizes = DEFAULT_SIZES if sizes is None else [int(size) for size in sizes]
+    results = []
+    for n in sizes:
+        for name, setup, run in workloads(n, seed):
+            if only is not None and name not in only:
+                continue
+            result = {"name": name, "n": n, **measure(setup, run, repeat)}
+            results.append(result)
+            if verbose:
+                print(f"{name:<16}{n:>10}  {result['min']:.4f} s  {result['peak_memory'] / 2 ** 20:.1f} MiB",
+                      flush=True)
+    return {"environment": environment(), "repeat": repeat, "seed": seed, "results": results}
+
+
+def environment():
+    """
+    commit, versions and machine the benchmarks ran on
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"commit": commit, "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+            "numpy": np.__version__, "pandas": pd.__version__, "machine": platform.machine(),
+            "processor": platform.processor(), "cpus": os.cpu_count()}
+
+
+def write_results(results, path):
+    with open(path, "w") as handle:
+        json.dump(results, handle, indent=2)
+
+
+def compare(old_path, new_path):
+    """
+    minimum times and peak memory of two result files side by side, ratio is new / old so values above 1 are
+    regressions
+    :return: list of (name, n, old time, new time, time ratio, memory ratio)
+    """
+    with open(old_path) as handle:
+        old = {(result["name"], result["n"]): result for result in json.load(handle)["results"]}
+    with open(new_path) as handle:
+        new = json.load(handle)["results"]
+    rows = []
+    for result in new:
+        key = (result["name"], result["n"])
+        if key not in old:
+            continue
+        before = old[key]
+        rows.append((key[0], key[1], before["min"], result["min"], result["min"] / max(before["min"], 1e-12),
+                     result["peak_memory"] / max(before["peak_memory"], 1)))
+    return rows
+
+
+def _cleanup(inputs):
+    if isinstance(inputs, str) and os.path.isdir(inputs):
+        shutil.rmtree(inputs, ignore_errors=True)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="benchmark the benchmate ranges module on synthetic intervals")
+    parser.add_argument("--sizes", nargs="+", type=float, default=DEFAULT_SIZES,
+                        help="numbers of intervals, e.g. 1e3 1e5 1e7")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per workload")
+    parser.add_argument("--seed", type=int, default=0, help="random seed of the synthetic data")
+    parser.add_argument("--only", nargs="+", default=None, help="only run these workloads")
+    parser.add_argument("--output", default=None, help="write the results to this json file")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), default=None,
+                        help="compare two result files instead of running")
+    args = parser.parse_args(args)
+
+    if args.compare is not None:
+        print(f"{'workload':<16}{'n':>10}{'old (s)':>12}{'new (s)':>12}{'time':>8}{'memory':>8}")
+        for name, n, before, after, time_ratio, memory_ratio in compare(*args.compare):
+            print(f"{name:<16}{n:>10}{before:>12.4f}{after:>12.4f}{time_ratio:>8.2f}{memory_ratio:>8.2f}")
+        return
+
+    results = run_benchmarks(args.sizes, args.repeat, args.seed, args.only)
+    if args.output is not None:
+        write_results(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
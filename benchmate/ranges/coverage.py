@@ -0,0 +1,129 @@
+import numpy as np
+
+
+class Rle:
+    def __init__(self, values, lengths, start=1):
+        """
+        run-length encoded vector, similar to Rle in Bioconductor. Position start + sum(lengths[:i]) up to
+        start + sum(lengths[:i+1]) - 1 all have values[i] so memory is proportional to the number of runs instead of the
+        length of the vector.
+        :param values: value of each run
+        :param lengths: length of each run, must be positive
+        :param start: position of the first element, coverage is 1-based so this defaults to 1
+        """
+        self.values = np.asarray(values)
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        if self.values.shape != self.lengths.shape:
+            raise ValueError("values and lengths must have the same length")
+        if (self.lengths <= 0).any():
+            raise ValueError("run lengths must be positive")
+        self.start = int(start)
+
+    @classmethod
+    def from_array(cls, values, start=1):
+        """
+        encode a dense array
+        """
+        values = np.asarray(values)
+        if values.shape[0] == 0:
+            return cls(values, np.empty(0, dtype=np.int64), start)
+        breaks = np.flatnonzero(values[1:] != values[:-1]) + 1
+        run_starts = np.concatenate([[0], breaks])
+        lengths = np.diff(np.append(run_starts, values.shape[0]))
+        return cls(values[run_starts], lengths, start)
+
+    @property
+    def run_starts(self):
+        """
+        position of the first element of every run
+        """
+        return self.start + np.cumsum(self.lengths) - self.lengths
+
+    @property
+    def end(self):
+        return self.start + int(self.lengths.sum()) - 1
+
+    def to_array(self):
+        return np.repeat(self.values, self.lengths)
+
+    def at(self, positions):
+        """
+        values at the given positions, positions outside the vector raise an IndexError
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        if ((positions < self.start) | (positions > self.end)).any():
+            raise IndexError(f"positions must be between {self.start} and {self.end}")
+        return self.values[np.searchsorted(self.run_starts, positions, side="right") - 1]
+
+    def __len__(self):
+        return int(self.lengths.sum())
+
+    def __eq__(self, other):
+        if not isinstance(other, Rle):
+            return False
+        return (self.start == other.start and np.array_equal(self.values, other.values)
+                and np.array_equal(self.lengths, other.lengths))
+
+    def __repr__(self):
+        return f"Rle(start={self.start}, runs={self.values.shape[0]}, length={len(self)})"
+
+
+def coverage(starts, ends, min_pos=None, max_pos=None, weights=None, rle=False):
+    """
+    per base coverage of closed [start, end] intervals between min_pos and max_pos. This is a difference array: +1 at
+    every start, -1 after every end and a cumulative sum, so the cost depends on the number of intervals and the span,
+    not on the number of covered bases.
+    :param starts: interval starts
+    :param ends: interval ends
+    :param min_pos: first position of the output, defaults to the smallest start
+    :param max_pos: last position of the output, defaults to the largest end
+    :param weights: optional weight per interval, coverage is then the sum of the weights
+    :param rle: return an Rle instead of a dense array, only the breakpoints are materialized
+    :return: numpy array with one value per position from min_pos to max_pos or an Rle
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    if starts.shape[0] == 0:
+        if min_pos is None or max_pos is None:
+            return Rle([], [], 1 if min_pos is None else min_pos) if rle else np.zeros(0, dtype=np.int64)
+    min_pos = int(starts.min()) if min_pos is None else int(min_pos)
+    max_pos = int(ends.max()) if max_pos is None else int(max_pos)
+
+    # clip to the requested window, intervals falling completely outside of it are dropped
+    keep = (ends >= min_pos) & (starts <= max_pos)
+    starts = np.maximum(starts[keep], min_pos)
+    ends = np.minimum(ends[keep], max_pos)
+    if weights is not None:
+        weights = np.asarray(weights)[keep]
+
+    if rle:
+        return _coverage_rle(starts, ends, min_pos, max_pos, weights)
+
+    length = max_pos - min_pos + 1
+    diff = (np.bincount(starts - min_pos, weights=weights, minlength=length + 1)
+            - np.bincount(ends - min_pos + 1, weights=weights, minlength=length + 1))
+    return np.cumsum(diff[:length])
+
+
+def _coverage_rle(starts, ends, min_pos, max_pos, weights=None):
+    if weights is None:
+        weights = np.ones(starts.shape[0], dtype=np.int64)
+    positions = np.concatenate([[min_pos], starts, ends + 1])
+    deltas = np.concatenate([[0], weights, -weights])
+    breaks, inverse = np.unique(positions, return_inverse=True)
+    values = np.cumsum(np.bincount(inverse, weights=deltas, minlength=breaks.shape[0]))
+    if np.issubdtype(weights.dtype, np.integer):
+        values = values.astype(np.int64)
+
+    # the last breakpoint can be one past max_pos (an interval ending at max_pos)
+    inside = breaks <= max_pos
+    breaks, values = breaks[inside], values[inside]
+    lengths = np.diff(np.append(breaks, max_pos + 1))
+
+    # merge neighbouring runs that ended up with the same value
+    if values.shape[0] > 1:
+        first = np.concatenate([[True], values[1:] != values[:-1]])
+        run_idx = np.cumsum(first) - 1
+        lengths = np.bincount(run_idx, weights=lengths).astype(np.int64)
+        values = values[first]
+    return Rle(values, lengths, min_pos)
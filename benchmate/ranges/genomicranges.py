@@ -1,14 +1,82 @@
 
+from collections import Counter
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
 from benchmate.ranges.ranges import Range, RangesList
+from benchmate.ranges.overlaps import OverlapIndex, check_overlap_type
+from benchmate.ranges.coverage import coverage
+from benchmate.ranges import setops, nearest, tiles, parallel
+
+# integer codes used wherever strands are stored or grouped on
+STRANDS = {"+": 1, "-": -1, "*": 0}
+STRAND_NAMES = np.array(["*", "+", "-"], dtype=object)
+
+
+def _encode_strands(strand):
+    strand = np.asarray(strand)
+    if strand.dtype.kind in "iu":
+        if strand.shape[0] > 0 and (np.abs(strand) > 1).any():
+            raise ValueError(f"strand codes must be one of {list(STRANDS.values())}")
+        return strand
+    codes = np.zeros(strand.shape[0], dtype=np.int8)
+    for name, code in STRANDS.items():
+        codes[strand == name] = code
+    unknown = ~np.isin(strand, list(STRANDS.keys()))
+    if unknown.any():
+        raise ValueError(f"strand must be one of {list(STRANDS.keys())}")
+    return codes
+
+
+def _read_only(values, dtype=None):
+    """
+    view of values as a numpy array that cannot be written to, the caller's array keeps its own flags
+    """
+    values = np.asarray(values, dtype=dtype).view()
+    values.flags.writeable = False
+    return values
+
+
+def _annotation_or_none(granges):
+    if granges.annotation is not None:
+        return granges.annotation
+    return np.full(len(granges), None, dtype=object)
+
+
+def _runs(columns):
+    """
+    stable sort of the rows made of the given columns
+    :return: the order and a mask over the sorted rows that is True where a row differs from the one before it
+    """
+    order = np.lexsort(columns[::-1])
+    same = np.ones(max(order.shape[0] - 1, 0), dtype=bool)
+    for column in columns:
+        values = column[order]
+        same &= values[1:] == values[:-1]
+    first = np.ones(order.shape[0], dtype=bool)
+    first[1:] = ~same
+    return order, first
 
 
 class GenomicRange:
+    __slots__ = ("chrom", "strand", "ranges", "annotation")
+
     def __init__(self, chrom, start, end, strand, annotation=None):
         self.chrom = chrom
         self.strand = strand
         self.ranges = Range(start, end)
         self.annotation = annotation
 
+    @property
+    def start(self):
+        return self.ranges.start
+
+    @property
+    def end(self):
+        return self.ranges.end
+
     def shift(self, amount):
         self.ranges=self.ranges.shift(amount)
         return self
@@ -18,9 +86,7 @@ class GenomicRange:
         return self
 
     def overlaps(self, other, ignore_strand=False, type="exact"):
-        overlap_types=["exact", "within", "start", "end", "any"]
-        if type not in overlap_types:
-            raise ValueError(f"overlap_type must be one of {overlap_types}")
+        check_overlap_type(type)
 
         if self.chrom != other.chrom:
             raise ValueError("Genomic ranges must have same chrom")
@@ -49,13 +115,17 @@ class GenomicRange:
 
 
     def __eq__(self, other, ignore_strand=False):
+        if not isinstance(other, GenomicRange):
+            return NotImplemented
         if self.chrom != other.chrom:
             return False
-        else:
-            if ignore_strand and self.strand == other.strand:
-                return self.ranges == other.ranges
-            else:
-                return self.ranges == other.ranges
+        if not ignore_strand and self.strand != other.strand:
+            return False
+        return self.ranges == other.ranges
+
+    def __hash__(self):
+        # the annotation is not part of the identity of a range, same as __eq__
+        return hash((self.chrom, self.ranges.start, self.ranges.end, self.strand))
 
 
 class GenomicRangesList:
@@ -64,120 +134,92 @@ class GenomicRangesList:
             assert isinstance(item, GenomicRange)
 
         self.items = granges
+        self._index = None
 
     def pop(self, index):
         assert (isinstance(index, int))
+        self._index = None
         return self.items.pop(index)
 
     def insert(self, index, value):
         assert (isinstance(index, int))
         assert (isinstance(value, GenomicRange))
         self.items.insert(index, value)
+        self._index = None
 
     def append(self, item):
         assert (isinstance(item, GenomicRange))
         self.items.append(item)
+        self._index = None
 
     def extend(self, other):
         assert (isinstance(other, GenomicRangesList))
         self.items.extend(other.items)
+        self._index = None
 
     def remove(self, item):
         assert (isinstance(item, GenomicRange))
         self.items.remove(item)
+        self._index = None
 
     def find_overlaps(self, other=None, type="exact", ignore_strand=False, return_ranges=True):
+        """
+        find overlapping pairs between this list (query) and other (subject), see Range.overlaps for the overlap types.
+        The subject is indexed once per call with an OverlapIndex so this is O((N + M) log M + k) instead of comparing
+        every pair.
+        :param other: another GenomicRangesList, if None overlaps are searched within this list
+        :param type: one of exact, within, start, end or any
+        :param ignore_strand: if False only ranges on the same strand are compared
+        :param return_ranges: return (query, subject) GenomicRange tuples, if False returns (i, j) index tuples
+        :return: list of tuples sorted by query then subject index
+        """
         if other is None:
             other = self
         assert (isinstance(other, GenomicRangesList))
-        overlaps = []
-        for i in range(len(self)):
-            for j in range(len(other)):
-                if self.items[i].chrom != other.items[j].chrom:
-                    continue
-                else:
-                    if not ignore_strand:
-                        if self.items[i].strand != other.items[j].strand:
-                            continue
-                        else:
-                            overlap = self.items[i].overlaps(other.items[j], ignore_strand=False,
-                                                             type=type)
-                    else:
-                        overlap = self.items[i].overlaps(other.items[j], ignore_strand=True, type=type)
-
-                if overlap is not None:
-                    if return_ranges:
-                        overlaps.append((self.items[i], other.items[j]))
-                    else:
-                        overlaps.append((i, j))
-        return overlaps
-
-    def coverage(self, ignore_strand=False):
-       """
-       Calculate coverage depth at each position per chromosome and strand.
-
-       :param ignore_strand: If True, combines coverage from both strands
-       :return: Dictionary of chromosomes, each containing coverage arrays
-               (either single array or separate arrays for + and - strands)
-       """
-       if not self.items:
-           return {}
-
-       # Group ranges by chromosome
-       chrom_ranges = {}
-       for grange in self.items:
-           if grange.chrom not in chrom_ranges:
-               if not ignore_strand:
-                   chrom_ranges[grange.chrom] = {"+": [], "-": []}
-               else:
-                   chrom_ranges[grange.chrom] = []
-
-           if not ignore_strand:
-               chrom_ranges[grange.chrom][grange.strand].append(grange.ranges)
-           else:
-               chrom_ranges[grange.chrom].append(grange.ranges)
-
-       # Calculate coverage for each chromosome
-       coverage_dict = {}
-       for chrom in chrom_ranges:
-           if not ignore_strand:
-               # Calculate coverage separately for each strand
-               coverage_dict[chrom] = {
-                   "+": self._calculate_coverage(chrom_ranges[chrom]["+"]),
-                   "-": self._calculate_coverage(chrom_ranges[chrom]["-"])
-               }
-           else:
-               # Calculate combined coverage
-               coverage_dict[chrom] = self._calculate_coverage(chrom_ranges[chrom])
-
-       return coverage_dict
-
-    def _calculate_coverage(self, ranges):
-       """
-       Helper method to calculate coverage for a list of ranges.
-
-       :param ranges: List of Range objects
-       :return: List of coverage depths
-       """
-       if not ranges:
-           return []
-
-       # Find the overall span
-       min_pos = min(r.start for r in ranges)
-       max_pos = max(r.end for r in ranges)
-       length = max_pos - min_pos + 1
-
-       # Initialize coverage array
-       coverage = [0] * length
-
-       # Count coverage for each range
-       for range_obj in ranges:
-           start_idx = range_obj.start - min_pos
-           end_idx = range_obj.end - min_pos + 1
-           for i in range(start_idx, end_idx):
-               coverage[i] += 1
-
-       return coverage
+        check_overlap_type(type)
+
+        chrom_codes = {}
+        q_starts, q_ends, q_groups = self._index_arrays(chrom_codes, ignore_strand)
+        s_starts, s_ends, s_groups = other._index_arrays(chrom_codes, ignore_strand)
+        index = OverlapIndex(s_starts, s_ends, s_groups)
+        query_idx, subject_idx = index.query(q_starts, q_ends, q_groups, type=type)
+
+        if return_ranges:
+            return [(self.items[i], other.items[j]) for i, j in zip(query_idx.tolist(), subject_idx.tolist())]
+        return list(zip(query_idx.tolist(), subject_idx.tolist()))
+
+    def _index_arrays(self, chrom_codes, ignore_strand=False):
+        """
+        start, end and group code arrays for the overlap index, chrom_codes is shared between the query and the
+        subject so that both sides use the same encoding
+        """
+        starts = np.fromiter((item.ranges.start for item in self.items), dtype=np.int64, count=len(self.items))
+        ends = np.fromiter((item.ranges.end for item in self.items), dtype=np.int64, count=len(self.items))
+        groups = np.empty(len(self.items), dtype=np.int64)
+        for i, item in enumerate(self.items):
+            code = chrom_codes.setdefault(item.chrom, len(chrom_codes))
+            if ignore_strand:
+                groups[i] = code
+            else:
+                if item.strand not in STRANDS:
+                    raise ValueError(f"strand must be one of {list(STRANDS.keys())}")
+                groups[i] = code * len(STRANDS) + STRANDS[item.strand] + 1
+        return starts, ends, groups
+
+    def coverage(self, ignore_strand=False, rle=False, chrom_sizes=None):
+        """
+        Calculate coverage depth at each position per chromosome and strand.
+
+        :param ignore_strand: If True, combines coverage from both strands
+        :param rle: If True, each coverage is a run-length encoded Rle instead of a dense numpy array
+        :param chrom_sizes: optional dictionary of chromosome sizes, coverage then spans the whole chromosome
+        :return: Dictionary of chromosomes, each containing coverage arrays
+                (either single array or separate arrays for + and - strands)
+        """
+        if not self.items:
+            return {}
+        return GenomicRanges.from_list(self.items).coverage(ignore_strand=ignore_strand, rle=rle,
+                                                            chrom_sizes=chrom_sizes)
 
     def __getitem__(self, item):
         if isinstance(item, int):
@@ -198,11 +240,12 @@ class GenomicRangesList:
 
     def __sub__(self, other):
         assert(isinstance(other, GenomicRangesList))
-        return GenomicRangesList([item for item in self.items if item not in other.items])
+        index = other._counts()
+        return GenomicRangesList([item for item in self.items if item not in index])
 
     def __contains__(self, item):
         assert(isinstance(item, GenomicRange))
-        return item in self.items
+        return item in self._counts()
 
     def __str__(self):
         return f"GenomicRangesList({self.items})"
@@ -214,19 +257,33 @@ class GenomicRangesList:
         assert(isinstance(index, int))
         assert(isinstance(value, GenomicRange))
         self.items[index] = value
+        self._index = None
 
     def __delitem__(self, index):
         assert(isinstance(index, int))
         del self.items[index]
+        self._index = None
 
     def __eq__(self, other):
         assert(isinstance(other, GenomicRangesList))
-        if len(self.items) != len(other.items):
-            return False
-        for item in self.items:
-            if item not in other.items:
-                return False
-        return True
+        # same ranges with the same number of copies, order does not matter
+        return len(self.items) == len(other.items) and self._counts() == other._counts()
+
+    def unique(self):
+        """
+        the first copy of every range in the order they appear in the list
+        :return: a new GenomicRangesList
+        """
+        return GenomicRangesList(list(dict.fromkeys(self.items)))
+
+    def _counts(self):
+        """
+        hash index of the items, range to number of copies. It is built on first use and dropped when the list is
+        changed through its methods, ranges that are shifted or extended in place after that are not seen by it.
+        """
+        if self._index is None:
+            self._index = Counter(self.items)
+        return self._index
 
     def __ne__(self, other):
         if not isinstance(other, GenomicRangesList):
@@ -236,28 +293,787 @@ class GenomicRangesList:
         else:
             return True
 
-    def reduce(self, ignore_strand=False):
-        ranges = {}
-        for item in self.items:
-            if item.chrom not in ranges.keys():
-                if not ignore_strand:
-                    ranges[item.chrom] = {"+": [], "-": []}
-                else:
-                    ranges[item.chrom] = []
-            else:
-                if not ignore_strand:
-                    ranges[item.chrom][item.strand].append(item.ranges)
-                else:
-                    ranges[item.chrom].append(item.ranges)
-
-        for chrom in ranges.keys():
-            if not ignore_strand:
-                ranges[chrom]["+"] = RangesList(ranges[chrom]["+"]).reduce()
-                ranges[chrom]["-"] = RangesList(ranges[chrom]["-"]).reduce()
-            else:
-                ranges[chrom] = RangesList(ranges[chrom]).reduce()
-        return ranges
+    def reduce(self, ignore_strand=False, gap=0):
+        """
+        merge overlapping ranges on each chromosome and strand, see GenomicRanges.reduce
+        :param ignore_strand: merge across strands
+        :param gap: ranges separated by at most this many bases are merged as well
+        :return: a GenomicRangesList of the merged ranges
+        """
+        if not self.items:
+            return GenomicRangesList([])
+        return GenomicRanges.from_list(self.items).reduce(gap=gap, ignore_strand=ignore_strand).to_list()
+
+
+class GenomicRanges:
+    def __init__(self, chrom, start, end, strand=None, annotation=None, chrom_names=None, validate=True):
+        """
+        Columnar collection of genomic ranges. Instead of one GenomicRange object per interval the chromosomes are kept
+        as int32 codes into chrom_names, starts and ends as int32 and strands as int8 (see STRANDS) so that tens of
+        millions of intervals fit in memory and every operation is a numpy expression. The arrays are read only,
+        operations return new GenomicRanges and slicing returns views that share memory with the parent.
+        :param chrom: chromosome names, or integer codes into chrom_names if chrom_names is given
+        :param start: 1-based inclusive starts
+        :param end: 1-based inclusive ends
+        :param strand: strands as "+", "-", "*" or their integer codes, None means all "*"
+        :param annotation: optional array with one annotation per range (numbers, strings, dicts...)
+        :param chrom_names: chromosome names the codes in chrom refer to
+        :param validate: check that starts are positive and not after the ends, this reads every value so it is
+            skipped for data that is already known to be valid (slices, files written by io.save_ranges)
+        """
+        factorized = chrom_names is None
+        if factorized:
+            codes, chrom_names = pd.factorize(np.asarray(chrom, dtype=object))
+            chrom_names = np.asarray(chrom_names, dtype=object)
+        else:
+            codes = chrom
+            chrom_names = np.asarray(chrom_names, dtype=object)
+
+        self.chrom_codes = _read_only(codes, np.int32)
+        self.starts = _read_only(start, np.int32)
+        self.ends = _read_only(end, np.int32)
+        if strand is None:
+            strand = np.zeros(self.starts.shape[0], dtype=np.int8)
+        self.strands = _read_only(_encode_strands(strand), np.int8)
+        self.chrom_names = chrom_names
+        self.annotation = None if annotation is None else _read_only(annotation)
+
+        n = self.starts.shape[0]
+        for name, column in [("chrom", self.chrom_codes), ("end", self.ends), ("strand", self.strands),
+                             ("annotation", self.annotation)]:
+            if column is not None and column.shape != (n,):
+                raise ValueError(f"{name} must be a 1d array with the same length as start")
+        if validate and n > 0 and ((self.starts > self.ends).any() or (self.starts < 0).any()):
+            raise ValueError("start and end must be positive and start needs to be <= end")
+        # pd.factorize gives -1 for a missing chromosome, it would silently index the last name
+        if n > 0 and (validate or factorized) and \
+                ((self.chrom_codes < 0).any() or (self.chrom_codes >= chrom_names.shape[0]).any()):
+            raise ValueError("chromosomes must not be missing and codes must index chrom_names")
+        self._indices = {}
+
+    @classmethod
+    def from_list(cls, granges):
+        """
+        build a columnar GenomicRanges from a GenomicRangesList (or any iterable of GenomicRange objects)
+        """
+        items = list(granges)
+        annotation = None
+        if any(item.annotation is not None for item in items):
+            annotation = np.empty(len(items), dtype=object)
+            annotation[:] = [item.annotation for item in items]
+        return cls([item.chrom for item in items],
+                   [item.ranges.start for item in items],
+                   [item.ranges.end for item in items],
+                   [item.strand for item in items], annotation=annotation)
+
+    @classmethod
+    def from_dataframe(cls, df, chrom="chrom", start="start", end="end", strand="strand", annotation=None):
+        """
+        build a GenomicRanges from a pandas DataFrame
+        :param df: the DataFrame
+        :param chrom, start, end, strand: column names, strand can be None if the data is unstranded
+        :param annotation: optional column to use as the annotation
+        """
+        chroms = df[chrom]
+        if isinstance(chroms.dtype, pd.CategoricalDtype):
+            codes, chrom_names = chroms.cat.codes.to_numpy(), chroms.cat.categories.to_numpy(dtype=object)
+        else:
+            codes, chrom_names = pd.factorize(chroms)
+        return cls(codes, df[start].to_numpy(), df[end].to_numpy(),
+                   None if strand is None else df[strand].to_numpy(),
+                   annotation=None if annotation is None else df[annotation].to_numpy(),
+                   chrom_names=chrom_names)
+
+    @property
+    def chroms(self):
+        """
+        chromosome name of every range
+        """
+        return self.chrom_names[self.chrom_codes]
+
+    @property
+    def strand_names(self):
+        """
+        strand of every range as "+", "-" or "*"
+        """
+        # codes are -1, 0 and 1 so negative indexing picks "-" for -1
+        return STRAND_NAMES[self.strands]
+
+    @property
+    def width(self):
+        return self.ends.astype(np.int64) - self.starts + 1
+
+    def shift(self, amount=0):
+        """
+        shift all the ranges by amount, amount can be a scalar or one value per range
+        """
+        amount = np.asarray(amount, dtype=np.int64)
+        return self._replace(self.starts + amount, self.ends + amount)
+
+    def extend(self, start=0, end=0):
+        """
+        add start to the starts and end to the ends, same as Range.extend, both can be scalars or arrays
+        """
+        return self._replace(self.starts + np.asarray(start, dtype=np.int64),
+                             self.ends + np.asarray(end, dtype=np.int64))
+
+    def sort(self, ignore_strand=False):
+        """
+        return a copy sorted by chromosome code, strand, start and end
+        """
+        return self[self.order(ignore_strand)]
+
+    def order(self, ignore_strand=False):
+        if ignore_strand:
+            return np.lexsort((self.ends, self.starts, self.chrom_codes))
+        return np.lexsort((self.ends, self.starts, self.strands, self.chrom_codes))
+
+    def duplicated(self, ignore_strand=False):
+        """
+        mark ranges that are a copy of an earlier one, same chromosome, start, end and strand, the annotation is not
+        compared. Rows are sorted once and compared with their neighbour instead of hashing every row in Python.
+        :param ignore_strand: ranges on different strands are copies of each other
+        :return: boolean mask, False for the first copy of every range
+        """
+        order, first = _runs(self._key_columns(self.chrom_codes, ignore_strand))
+        mask = np.empty(len(self), dtype=bool)
+        mask[order] = ~first
+        return mask
+
+    def unique(self, ignore_strand=False):
+        """
+        the first copy of every range in the original order, see duplicated
+        """
+        return self[~self.duplicated(ignore_strand)]
+
+    def isin(self, other, ignore_strand=False):
+        """
+        which ranges are also in other, e.g. to diff two annotation releases: a[~a.isin(b)] are the removed ranges
+        :param other: GenomicRanges, the chromosome names do not need to be in the same order
+        :param ignore_strand: ignore the strands when comparing
+        :return: boolean mask aligned with these ranges
+        """
+        assert isinstance(other, GenomicRanges)
+        other_codes = other._chrom_codes_in(self.chrom_names)
+        keep = other_codes >= 0
+        columns = [np.concatenate([ours, theirs]) for ours, theirs in
+                   zip(self._key_columns(self.chrom_codes, ignore_strand),
+                       other._key_columns(other_codes, ignore_strand, keep))]
+        order, first = _runs(columns)
+        # a run of equal rows is a hit if any of its rows comes from other
+        run = np.cumsum(first) - 1
+        from_other = np.bincount(run, weights=order >= len(self))
+        mask = np.empty(columns[0].shape[0], dtype=bool)
+        mask[order] = from_other[run] > 0
+        return mask[:len(self)]
+
+    def _key_columns(self, chrom_codes, ignore_strand, rows=slice(None)):
+        strands = np.zeros(len(self), dtype=np.int8) if ignore_strand else self.strands
+        return [np.asarray(chrom_codes, dtype=np.int64)[rows], self.starts[rows].astype(np.int64),
+                self.ends[rows].astype(np.int64), strands[rows].astype(np.int64)]
+
+    def find_overlaps(self, other=None, type="exact", ignore_strand=False, return_widths=False, n_jobs=None):
+        """
+        find overlapping pairs between these ranges (query) and other (subject), overlap types are the same as
+        Range.overlaps. The OverlapIndex of the subject is cached on it so repeated queries against the same
+        subject only pay for the binary searches.
+        :param return_widths: also return the number of bases shared by each pair
+        :param n_jobs: number of processes (or an Executor) to search chromosomes in parallel, the cached index is not
+            used then since every worker indexes its own chromosome
+        :return: two int64 arrays, query indices and subject indices, sorted by query then subject, plus the overlap
+            widths with return_widths
+        """
+        if other is None:
+            other = self
+        query_idx, subject_idx = self._overlap_pairs(other, type, ignore_strand, n_jobs)
+        if return_widths:
+            widths = (np.minimum(self.ends[query_idx], other.ends[subject_idx]).astype(np.int64)
+                      - np.maximum(self.starts[query_idx], other.starts[subject_idx]) + 1)
+            return query_idx, subject_idx, widths
+        return query_idx, subject_idx
+
+    def count_overlaps(self, other, type="any", ignore_strand=False, n_jobs=None):
+        """
+        number of ranges in other overlapping each range, e.g. reads per gene
+        :return: int64 array aligned with these ranges
+        """
+        query_idx, _ = self._overlap_pairs(other, type, ignore_strand, n_jobs)
+        return np.bincount(query_idx, minlength=len(self))
+
+    def aggregate_overlaps(self, other, values, fn="sum", type="any", ignore_strand=False, n_jobs=None):
+        """
+        aggregate a value of the overlapping ranges in other for each range, e.g. the mean score of the peaks in
+        each region. The reduction is done with np.bincount / np.*.reduceat over the overlap pairs.
+        :param other: GenomicRanges to aggregate
+        :param values: array with one value per range in other, or the name of a field of its structured annotation
+        :param fn: one of sum, mean, min, max or count
+        :return: array aligned with these ranges, ranges without overlaps get 0 for sum and count and nan otherwise
+        """
+        functions = ["sum", "mean", "min", "max", "count"]
+        if fn not in functions:
+            raise ValueError(f"fn must be one of {functions}")
+        if isinstance(values, str):
+            values = other.annotation[values]
+        values = np.asarray(values)
+        if values.shape != (len(other),):
+            raise ValueError("values must have one value per range in other")
+
+        query_idx, subject_idx = self._overlap_pairs(other, type, ignore_strand, n_jobs)
+        counts = np.bincount(query_idx, minlength=len(self))
+        if fn == "count":
+            return counts
+        hit_values = values[subject_idx].astype(np.float64)
+        if fn in ("sum", "mean"):
+            sums = np.bincount(query_idx, weights=hit_values, minlength=len(self))
+            if fn == "sum":
+                return sums
+            with np.errstate(invalid="ignore", divide="ignore"):
+                return sums / counts
+
+        result = np.full(len(self), np.nan)
+        if query_idx.shape[0] > 0:
+            # the pairs are sorted by query so each query with hits is one contiguous block
+            starts = np.flatnonzero(np.concatenate([[True], query_idx[1:] != query_idx[:-1]]))
+            reduce = np.minimum if fn == "min" else np.maximum
+            result[query_idx[starts]] = reduce.reduceat(hit_values, starts)
+        return result
+
+    def _overlap_pairs(self, other, type, ignore_strand, n_jobs):
+        assert isinstance(other, GenomicRanges)
+        check_overlap_type(type)
+        groups = self._group_codes(other.chrom_names, ignore_strand)
+        if parallel.is_serial(n_jobs):
+            return other.overlap_index(ignore_strand).query(self.starts, self.ends, groups, type=type)
+
+        tables = [(groups, {"starts": self.starts, "ends": self.ends}),
+                  (other._group_codes(ignore_strand=ignore_strand), {"starts": other.starts, "ends": other.ends})]
+        results = parallel.map_groups(partial(parallel.overlaps_task, type=type), tables, n_jobs)
+        query_idx = np.concatenate([np.empty(0, dtype=np.int64)] + [result[0] for _, result in results])
+        subject_idx = np.concatenate([np.empty(0, dtype=np.int64)] + [result[1] for _, result in results])
+        order = np.lexsort((subject_idx, query_idx))
+        return query_idx[order], subject_idx[order]
+
+    def tile(self, width, chunk_size=1000000):
+        """
+        split every range into consecutive windows of width bases, the last one is truncated at the end of the range
+        :param width: window width
+        :param chunk_size: maximum number of windows per yielded chunk
+        :return: generator of GenomicRanges, the annotation of each window is the index of the range it came from
+        """
+        return self.slide(width, step=width, chunk_size=chunk_size)
+
+    def slide(self, width, step=None, chunk_size=1000000):
+        """
+        windows of width bases every step bases along each range, see tiles.sliding_windows
+        :return: generator of GenomicRanges, the annotation of each window is the index of the range it came from
+        """
+        for interval, starts, ends in tiles.sliding_windows(self.starts, self.ends, width, step, chunk_size):
+            yield GenomicRanges(self.chrom_codes[interval], starts, ends, self.strands[interval],
+                                annotation=interval, chrom_names=self.chrom_names)
+
+    @classmethod
+    def bin_genome(cls, chrom_sizes, width, chunk_size=1000000):
+        """
+        consecutive unstranded bins of width bases covering every chromosome
+        :param chrom_sizes: dictionary of chromosome sizes
+        :param width: bin width
+        :param chunk_size: maximum number of bins per yielded chunk
+        :return: generator of GenomicRanges
+        """
+        genome = cls(list(chrom_sizes.keys()), np.ones(len(chrom_sizes), dtype=np.int64), list(chrom_sizes.values()))
+        for chunk in genome.tile(width, chunk_size):
+            chunk.annotation = None
+            yield chunk
+
+    def bin_counts(self, chrom_sizes, width, weights=None):
+        """
+        number of ranges overlapping each bin of the genome.bin_genome(chrom_sizes, width) bins, ignoring strand
+        :param chrom_sizes: dictionary of chromosome sizes
+        :param width: bin width
+        :param weights: optional weight per range, bins then get the sum of the weights (e.g. a signal value)
+        :return: dictionary of chromosome to an array with one value per bin
+        """
+        codes = self._chrom_codes_in(np.asarray(list(chrom_sizes.keys()), dtype=object))
+        counts = {}
+        for code, (chrom, size) in enumerate(chrom_sizes.items()):
+            mask = codes == code
+            counts[chrom] = tiles.bin_counts(self.starts[mask], self.ends[mask], size, width,
+                                             weights=None if weights is None else np.asarray(weights)[mask])
+        return counts
+
+    def nearest(self, other, ignore_strand=False):
+        """
+        index of the nearest range in other for every range, an overlapping one if there is any
+        :param other: GenomicRanges to search
+        :param ignore_strand: if False only ranges on the same strand are considered
+        :return: int64 array of indices into other, -1 where there is no range on the same chromosome (and strand)
+        """
+        return self.distance_to_nearest(other, ignore_strand)[0]
+
+    def distance_to_nearest(self, other, ignore_strand=False):
+        """
+        same as nearest but also returns the distance, 0 for overlapping ranges, see Range.distance
+        :return: indices into other and distances, both -1 where there is no nearest range
+        """
+        assert isinstance(other, GenomicRanges)
+        groups = self._group_codes(other.chrom_names, ignore_strand)
+        return nearest.nearest(self.starts, self.ends, groups, other.starts, other.ends,
+                               other._group_codes(ignore_strand=ignore_strand),
+                               index=other.overlap_index(ignore_strand))
+
+    def precede(self, other, ignore_strand=False):
+        """
+        index of the range in other that each range precedes, the closest non overlapping one downstream (strand
+        aware, with ignore_strand everything is treated as +)
+        :return: int64 array of indices into other, -1 where there is none
+        """
+        return self._flank(other, nearest.precede, ignore_strand)
+
+    def follow(self, other, ignore_strand=False):
+        """
+        index of the range in other that each range follows, the closest non overlapping one upstream
+        :return: int64 array of indices into other, -1 where there is none
+        """
+        return self._flank(other, nearest.follow, ignore_strand)
+
+    def _flank(self, other, op, ignore_strand):
+        assert isinstance(other, GenomicRanges)
+        strands = np.zeros(len(self), dtype=np.int8) if ignore_strand else self.strands
+        return op(self.starts, self.ends, self._group_codes(other.chrom_names, ignore_strand), strands,
+                  other.starts, other.ends, other._group_codes(ignore_strand=ignore_strand))
+
+    def coverage(self, ignore_strand=False, rle=False, chrom_sizes=None, weights=None, n_jobs=None):
+        """
+        per base coverage for each chromosome (and strand) computed with a difference array, see ranges.coverage
+        :param ignore_strand: combine the strands
+        :param rle: return Rle objects instead of dense arrays, memory is then proportional to the breakpoints
+        :param chrom_sizes: optional dictionary of chromosome sizes, coverage then spans 1 to the chromosome size
+            instead of the smallest start to the largest end
+        :param weights: optional weight for each range, e.g. a score column
+        :param n_jobs: number of processes (or an Executor) to compute chromosomes in parallel, see parallel.map_groups
+        :return: {chrom: coverage} if ignore_strand else {chrom: {"+": coverage, "-": coverage}}, "*" is added when
+            there are unstranded ranges
+        """
+        groups = self._group_codes(ignore_strand=ignore_strand)
+        columns = {"starts": self.starts, "ends": self.ends}
+        if weights is not None:
+            columns["weights"] = np.asarray(weights)
+        bounds = None
+        if chrom_sizes is not None:
+            bounds = {}
+            for group in np.unique(groups).tolist():
+                chrom = self.chrom_names[group if ignore_strand else group // len(STRANDS)]
+                bounds[group] = (1, chrom_sizes[chrom])
+        task = partial(parallel.coverage_task, bounds=bounds, rle=rle)
+        results = dict(parallel.map_groups(task, [(groups, columns)], n_jobs))
+
+        coverages = {}
+        for code, chrom in enumerate(self.chrom_names.tolist()):
+            if ignore_strand:
+                if code in results:
+                    coverages[chrom] = results[code]
+                continue
+            keys = {name: code * len(STRANDS) + STRANDS[name] + 1 for name in ["+", "-", "*"]}
+            if not any(key in results for key in keys.values()):
+                continue
+            min_pos, max_pos = (None, None) if chrom_sizes is None else (1, chrom_sizes[chrom])
+            chrom_coverage = {}
+            for name, key in keys.items():
+                if key in results:
+                    chrom_coverage[name] = results[key]
+                elif name != "*":
+                    chrom_coverage[name] = coverage([], [], min_pos, max_pos, rle=rle)
+            coverages[chrom] = chrom_coverage
+        return coverages
+
+    def reduce(self, gap=0, ignore_strand=False, n_jobs=None):
+        """
+        merge overlapping (and book-ended) ranges on each chromosome and strand
+        :param gap: ranges separated by at most this many bases are merged as well
+        :param ignore_strand: merge across strands, the result is unstranded
+        :param n_jobs: number of processes (or an Executor) to merge chromosomes in parallel
+        :return: GenomicRanges sorted by chromosome, strand and start
+        """
+        groups = self._group_codes(ignore_strand=ignore_strand)
+        if parallel.is_serial(n_jobs):
+            result = setops.merge(self.starts, self.ends, groups, gap=gap)
+        else:
+            result = parallel.concat_results(parallel.map_groups(
+                partial(parallel.merge_task, gap=gap), [(groups, {"starts": self.starts, "ends": self.ends})], n_jobs))
+        return self._from_groups(self.chrom_names, *result, ignore_strand)
+
+    def disjoin(self, ignore_strand=False):
+        """
+        split the ranges into the smallest non overlapping pieces, every piece is covered by the same set of ranges
+        """
+        groups = self._group_codes(ignore_strand=ignore_strand)
+        result = setops.disjoin(self.starts, self.ends, groups)
+        return self._from_groups(self.chrom_names, *result, ignore_strand)
+
+    def gaps(self, chrom_sizes, ignore_strand=False):
+        """
+        regions of each chromosome that are not covered by any range, e.g. intergenic regions from genes
+        :param chrom_sizes: dictionary of chromosome sizes, only these chromosomes are reported
+        :param ignore_strand: if False gaps are reported for the + and - strand (and * if there are unstranded
+            ranges) separately, if True the gaps are unstranded
+        """
+        chrom_names = np.asarray(list(dict.fromkeys(self.chrom_names.tolist() + list(chrom_sizes.keys()))),
+                                 dtype=object)
+        groups = self._group_codes(chrom_names, ignore_strand)
+        if ignore_strand:
+            strands = [0]
+        else:
+            strands = [STRANDS["+"], STRANDS["-"]] + ([STRANDS["*"]] if (self.strands == STRANDS["*"]).any() else [])
+        sizes = {}
+        for code, name in enumerate(chrom_names.tolist()):
+            if name not in chrom_sizes:
+                continue
+            for strand in strands:
+                sizes[code if ignore_strand else code * len(STRANDS) + strand + 1] = chrom_sizes[name]
+        result = setops.gaps(self.starts, self.ends, groups, sizes)
+        return self._from_groups(chrom_names, *result, ignore_strand)
+
+    def union(self, other, ignore_strand=False, n_jobs=None):
+        """
+        positions covered by either these ranges or other, reduced
+        """
+        return self._setop(other, "union", ignore_strand, n_jobs)
+
+    def intersect(self, other, ignore_strand=False, n_jobs=None):
+        """
+        positions covered by both these ranges and other
+        """
+        return self._setop(other, "intersect", ignore_strand, n_jobs)
+
+    def setdiff(self, other, ignore_strand=False, n_jobs=None):
+        """
+        positions covered by these ranges but not by other
+        """
+        return self._setop(other, "setdiff", ignore_strand, n_jobs)
+
+    def _setop(self, other, op, ignore_strand, n_jobs=None):
+        assert isinstance(other, GenomicRanges)
+        combined = self + other
+        groups = combined._group_codes(ignore_strand=ignore_strand)
+        n = len(self)
+        if parallel.is_serial(n_jobs):
+            result = getattr(setops, op)(combined.starts[:n], combined.ends[:n], groups[:n],
+                                         combined.starts[n:], combined.ends[n:], groups[n:])
+        else:
+            tables = [(groups[:n], {"starts": combined.starts[:n], "ends": combined.ends[:n]}),
+                      (groups[n:], {"starts": combined.starts[n:], "ends": combined.ends[n:]})]
+            result = parallel.concat_results(parallel.map_groups(partial(parallel.setop_task, op=op), tables, n_jobs))
+        return self._from_groups(combined.chrom_names, *result, ignore_strand)
+
+    @staticmethod
+    def _from_groups(chrom_names, groups, starts, ends, ignore_strand):
+        """
+        build GenomicRanges from group codes made by _group_codes
+        """
+        if ignore_strand:
+            codes, strands = groups, np.zeros(groups.shape[0], dtype=np.int8)
+        else:
+            codes, strands = groups // len(STRANDS), groups % len(STRANDS) - 1
+        return GenomicRanges(codes, starts, ends, strands, chrom_names=chrom_names)
+
+    def overlap_index(self, ignore_strand=False):
+        if ignore_strand not in self._indices:
+            self._indices[ignore_strand] = OverlapIndex(self.starts, self.ends,
+                                                        self._group_codes(ignore_strand=ignore_strand))
+        return self._indices[ignore_strand]
+
+    def _chrom_codes_in(self, chrom_names):
+        """
+        chromosome codes of these ranges translated to another list of chromosome names, -1 where the chromosome is
+        missing from it
+        """
+        if chrom_names is self.chrom_names or np.array_equal(chrom_names, self.chrom_names):
+            return self.chrom_codes
+        lookup = {name: code for code, name in enumerate(chrom_names.tolist())}
+        translate = np.array([lookup.get(name, -1) for name in self.chrom_names.tolist()], dtype=np.int64)
+        return translate[self.chrom_codes] if translate.shape[0] > 0 else self.chrom_codes.astype(np.int64)
+
+    def _group_codes(self, chrom_names=None, ignore_strand=False):
+        """
+        group codes (chrom or chrom/strand) for the overlap index and set operations, chrom_names sets the chromosome
+        encoding so that two GenomicRanges can be compared, defaults to our own
+        """
+        codes = self._chrom_codes_in(self.chrom_names if chrom_names is None else chrom_names).astype(np.int64)
+        if ignore_strand:
+            return codes
+        groups = codes * len(STRANDS) + self.strands + 1
+        groups[codes < 0] = -1
+        return groups
+
+    def _replace(self, starts, ends):
+        return GenomicRanges(self.chrom_codes, starts, ends, self.strands, annotation=self.annotation,
+                             chrom_names=self.chrom_names)
+
+    def to_list(self):
+        """
+        convert to a GenomicRangesList of GenomicRange objects
+        """
+        return GenomicRangesList(list(self))
+
+    def to_dataframe(self):
+        df = pd.DataFrame({"chrom": pd.Categorical.from_codes(self.chrom_codes, categories=self.chrom_names),
+                           "start": self.starts, "end": self.ends, "strand": self.strand_names})
+        if self.annotation is not None and self.annotation.dtype.names is not None:
+            for name in self.annotation.dtype.names:
+                df[name] = self.annotation[name]
+        elif self.annotation is not None:
+            df["annotation"] = self.annotation
+        return df
 
+    def __getitem__(self, item):
+        if isinstance(item, (int, np.integer)):
+            annotation = None if self.annotation is None else self.annotation[item]
+            return GenomicRange(self.chrom_names[self.chrom_codes[item]], int(self.starts[item]),
+                                int(self.ends[item]), STRAND_NAMES[self.strands[item]], annotation)
+        # slices give views, boolean masks and index arrays give copies
+        return GenomicRanges(self.chrom_codes[item], self.starts[item], self.ends[item], self.strands[item],
+                             annotation=None if self.annotation is None else self.annotation[item],
+                             chrom_names=self.chrom_names, validate=False)
+
+    def __len__(self):
+        return self.starts.shape[0]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __add__(self, other):
+        assert isinstance(other, GenomicRanges)
+        return GenomicRanges.concat([self, other])
+
+    @classmethod
+    def concat(cls, parts):
+        """
+        concatenate several GenomicRanges into one, chromosome names are merged in order of appearance
+        """
+        parts = list(parts)
+        lookup = {}
+        for part in parts:
+            for name in part.chrom_names.tolist():
+                lookup.setdefault(name, len(lookup))
+        codes = []
+        for part in parts:
+            translate = np.array([lookup[name] for name in part.chrom_names.tolist()], dtype=np.int32)
+            codes.append(translate[part.chrom_codes] if translate.shape[0] > 0 else part.chrom_codes)
+        annotation = None
+        if any(part.annotation is not None for part in parts):
+            annotation = np.concatenate([_annotation_or_none(part) for part in parts])
+        return cls(np.concatenate(codes) if len(codes) > 0 else [],
+                   np.concatenate([part.starts for part in parts]) if len(parts) > 0 else [],
+                   np.concatenate([part.ends for part in parts]) if len(parts) > 0 else [],
+                   np.concatenate([part.strands for part in parts]) if len(parts) > 0 else None,
+                   annotation=annotation, chrom_names=np.asarray(list(lookup.keys()), dtype=object))
+
+    def __str__(self):
+        return f"GenomicRanges with {len(self)} ranges on {len(self.chrom_names)} chromosomes"
+
+    def __repr__(self):
+        preview = ", ".join(str(item) for item in self[:5])
+        if len(self) > 5:
+            preview += ", ..."
+        return f"GenomicRanges([{preview}])"
+
+
+
+class GroupedGenomicRanges:
+    def __init__(self, ranges, offsets, names=None):
+        """
+        groups of genomic ranges, e.g. exons by transcript, similar to GRangesList in Bioconductor. All members are
+        stored in a single GenomicRanges and group i is ranges[offsets[i]:offsets[i + 1]], so grouped operations are
+        one vectorized pass over all the members instead of a Python loop over the groups.
+        :param ranges: GenomicRanges with the members, sorted by group
+        :param offsets: int64 array of length number of groups + 1, starts at 0 and ends at len(ranges)
+        :param names: optional group names, e.g. transcript ids
+        """
+        assert isinstance(ranges, GenomicRanges)
+        offsets = np.asarray(offsets, dtype=np.int64)
+        if offsets.ndim != 1 or offsets.shape[0] == 0 or offsets[0] != 0 or offsets[-1] != len(ranges) \
+                or (np.diff(offsets) < 0).any():
+            raise ValueError("offsets must increase from 0 to the number of ranges")
+        if names is not None:
+            names = np.asarray(names, dtype=object)
+            if names.shape[0] != offsets.shape[0] - 1:
+                raise ValueError("there must be one name per group")
+        self.ranges = ranges
+        self.offsets = _read_only(offsets)
+        self.names = names
+        self._lookup = None
+
+    @classmethod
+    def from_groups(cls, granges, by):
+        """
+        group ranges by a label, groups are in order of first appearance and keep the order of their members
+        :param granges: GenomicRanges
+        :param by: one label per range or the name of a field of the structured annotation, e.g. "transcript_id".
+            Ranges with a missing (None or nan) label are dropped.
+        """
+        if isinstance(by, str):
+            by = granges.annotation[by]
+        codes, names = pd.factorize(np.asarray(by), sort=False)
+        if codes.shape[0] != len(granges):
+            raise ValueError("by must have one label per range")
+        order = np.argsort(codes, kind="stable")
+        order = order[codes[order] >= 0]
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(codes[order], minlength=len(names)))])
+        return cls(granges[order], offsets, np.asarray(names, dtype=object))
+
+    @classmethod
+    def from_dict(cls, groups):
+        """
+        :param groups: dictionary of group name to GenomicRanges or GenomicRangesList, e.g. a GenomicRangesDict
+        """
+        parts = [value if isinstance(value, GenomicRanges) else GenomicRanges.from_list(value)
+                 for value in groups.values()]
+        lengths = [len(part) for part in parts]
+        return cls(GenomicRanges.concat(parts), np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)]),
+                   list(groups.keys()))
+
+    @property
+    def lengths(self):
+        """
+        number of members of each group
+        """
+        return np.diff(self.offsets)
+
+    @property
+    def group_index(self):
+        """
+        group number of every member
+        """
+        return np.repeat(np.arange(len(self)), self.lengths)
+
+    def unlist(self):
+        """
+        all the members as one GenomicRanges, see group_index for their groups
+        """
+        return self.ranges
+
+    def total_width(self):
+        """
+        number of bases in each group counting overlapping members once per member, reduce() first to count them
+        once
+        :return: int64 array with one value per group
+        """
+        widths = np.concatenate([[0], np.cumsum(self.ranges.width, dtype=np.int64)])
+        return widths[self.offsets[1:]] - widths[self.offsets[:-1]]
+
+    def range(self, ignore_strand=False):
+        """
+        smallest range spanning the members of each group, one per chromosome and strand if a group spans several
+        :return: GroupedGenomicRanges with the same groups
+        """
+        groups, keys = self._member_keys(ignore_strand)
+        order = np.lexsort((keys, groups))
+        groups, keys = groups[order], keys[order]
+        if groups.shape[0] == 0:
+            return self._from_members(groups, keys, self.ranges.starts, self.ranges.ends, ignore_strand)
+        first = np.flatnonzero(np.concatenate([[True], (groups[1:] != groups[:-1]) | (keys[1:] != keys[:-1])]))
+        return self._from_members(groups[first], keys[first], np.minimum.reduceat(self.ranges.starts[order], first),
+                                  np.maximum.reduceat(self.ranges.ends[order], first), ignore_strand)
+
+    def reduce(self, gap=0, ignore_strand=False):
+        """
+        merge overlapping members within each group, e.g. the exonic regions of each gene, see GenomicRanges.reduce
+        :return: GroupedGenomicRanges with the same groups, members sorted by chromosome, strand and start
+        """
+        groups, keys = self._member_keys(ignore_strand)
+        span = self._key_span(ignore_strand)
+        merged, starts, ends = setops.merge(self.ranges.starts, self.ranges.ends, groups * span + keys, gap=gap)
+        return self._from_members(merged // span, merged % span, starts, ends, ignore_strand)
+
+    def find_overlaps(self, other, type="any", ignore_strand=False, n_jobs=None):
+        """
+        pairs of groups (or of a group and a range) that overlap, two groups overlap if any of their members do. The
+        member overlaps are found in one call on the flat ranges and mapped back to their groups.
+        :param other: GroupedGenomicRanges or GenomicRanges
+        :return: two int64 arrays, query group indices and subject group (or range) indices, without repeats and
+            sorted by query then subject
+        """
+        subject = other.ranges if isinstance(other, GroupedGenomicRanges) else other
+        query_idx, subject_idx = self.ranges.find_overlaps(subject, type=type, ignore_strand=ignore_strand,
+                                                           n_jobs=n_jobs)
+        query_idx = self.group_index[query_idx]
+        n_subjects = len(other)
+        if isinstance(other, GroupedGenomicRanges):
+            subject_idx = other.group_index[subject_idx]
+        pairs = np.unique(query_idx * max(n_subjects, 1) + subject_idx)
+        return pairs // max(n_subjects, 1), pairs % max(n_subjects, 1)
+
+    def count_overlaps(self, other, type="any", ignore_strand=False, n_jobs=None):
+        """
+        number of groups (or ranges) in other overlapping each group
+        """
+        query_idx, _ = self.find_overlaps(other, type=type, ignore_strand=ignore_strand, n_jobs=n_jobs)
+        return np.bincount(query_idx, minlength=len(self))
+
+    def items(self):
+        """
+        (name, GenomicRanges) for every group, the name is the group number if there are no names
+        """
+        for i in range(len(self)):
+            yield (i if self.names is None else self.names[i]), self[i]
+
+    def _member_keys(self, ignore_strand):
+        return self.group_index, self.ranges._group_codes(ignore_strand=ignore_strand)
+
+    def _key_span(self, ignore_strand):
+        return max(len(self.ranges.chrom_names), 1) * (1 if ignore_strand else len(STRANDS))
+
+    def _from_members(self, groups, keys, starts, ends, ignore_strand):
+        """
+        GroupedGenomicRanges with the same groups from member group numbers and group codes sorted by group
+        """
+        ranges = GenomicRanges._from_groups(self.ranges.chrom_names, keys, starts, ends, ignore_strand)
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(groups, minlength=len(self)))])
+        return GroupedGenomicRanges(ranges, offsets, self.names)
+
+    def _group_number(self, name):
+        if self._lookup is None:
+            if self.names is None:
+                raise KeyError(name)
+            self._lookup = {key: i for i, key in enumerate(self.names.tolist())}
+        return self._lookup[name]
+
+    def __getitem__(self, item):
+        """
+        a group number or name gives the members of that group as GenomicRanges, slices, masks and index arrays give
+        GroupedGenomicRanges
+        """
+        if isinstance(item, (int, np.integer, str)):
+            i = self._group_number(item) if isinstance(item, str) else int(item)
+            return self.ranges[int(self.offsets[i]):int(self.offsets[i + 1])]
+        if isinstance(item, slice):
+            lo, hi, step = item.indices(len(self))
+            if step == 1:
+                offsets = self.offsets[lo:max(hi, lo) + 1]
+                return GroupedGenomicRanges(self.ranges[int(offsets[0]):int(offsets[-1])], offsets - offsets[0],
+                                            None if self.names is None else self.names[lo:max(hi, lo)])
+            item = np.arange(lo, hi, step)
+        item = np.arange(len(self))[item]
+        lengths = self.lengths[item]
+        # member positions of the selected groups, one arange per group done as a single repeat
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        members = np.repeat(self.offsets[:-1][item] - offsets[:-1], lengths) + np.arange(offsets[-1])
+        return GroupedGenomicRanges(self.ranges[members], offsets,
+                                    None if self.names is None else self.names[item])
+
+    def __len__(self):
+        return self.offsets.shape[0] - 1
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __str__(self):
+        return f"GroupedGenomicRanges with {len(self)} groups and {len(self.ranges)} ranges"
+
+    def __repr__(self):
+        return f"GroupedGenomicRanges({len(self)} groups, {len(self.ranges)} ranges)"
 
 
 class GenomicRangesDict(dict):
@@ -279,6 +1095,13 @@ class GenomicRangesDict(dict):
             overlaps[key] = self[key].find_overlaps(other[key], type=type, ignore_strand=ignore_strand)
         return overlaps
 
+    def to_grouped(self):
+        """
+        convert to a GroupedGenomicRanges with the keys as group names, a single columnar store for all the values
+        """
+        return GroupedGenomicRanges.from_dict({key: GenomicRangesList([value]) if isinstance(value, GenomicRange)
+                                               else value for key, value in self.items()})
+
     def __getitem__(self, key):
         assert (isinstance(key, str))
         return super().__getitem__(key)
@@ -0,0 +1,228 @@
+import gzip
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from benchmate.ranges.genomicranges import GenomicRanges
+
+# column names and dtypes of the supported formats, the first three columns are always chrom, start, end
+BED_COLUMNS = [("chrom", "category"), ("start", np.int64), ("end", np.int64), ("name", object),
+               ("score", object), ("strand", object), ("thick_start", np.int64), ("thick_end", np.int64),
+               ("item_rgb", object), ("block_count", np.int64), ("block_sizes", object), ("block_starts", object)]
+
+NARROWPEAK_COLUMNS = BED_COLUMNS[:6] + [("signal_value", np.float64), ("p_value", np.float64),
+                                        ("q_value", np.float64), ("peak", np.int64)]
+
+GTF_COLUMNS = [("chrom", "category"), ("source", "category"), ("feature", "category"), ("start", np.int64),
+               ("end", np.int64), ("score", object), ("strand", object), ("frame", object), ("attributes", object)]
+
+HEADER_PREFIXES = ("#", "track", "browser")
+
+# on disk layout written by save_ranges, one .npy file per column and a json file with the chromosome names
+RANGES_FORMAT = "benchmate.genomicranges"
+RANGES_VERSION = 1
+RANGES_COLUMNS = {"chrom_codes": np.int32, "starts": np.int32, "ends": np.int32, "strands": np.int8}
+
+
+def read_bed(path, n_columns=None, chunk_size=None, by_chrom=False):
+    """
+    read a BED3 to BED12 file into GenomicRanges. BED is 0-based and half open, the ranges are converted to the 1-based
+    inclusive coordinates used everywhere else. Columns after the third are kept as a structured annotation array
+    (gr.annotation["name"], gr.annotation["score"] ...).
+    :param path: path to the file, can be gzipped
+    :param n_columns: number of columns to read, detected from the first line if None
+    :param chunk_size: if given, return a generator of GenomicRanges with at most this many lines each
+    :param by_chrom: return a generator of (chrom, GenomicRanges) tuples, one per chromosome, the file needs to be
+        sorted by chromosome, see group_by_chrom
+    :return: GenomicRanges or a generator, see chunk_size and by_chrom
+    """
+    skip, first_line = _header(path)
+    if n_columns is None:
+        n_columns = len(first_line.split("\t"))
+    if n_columns < 3 or n_columns > len(BED_COLUMNS):
+        raise ValueError(f"BED files need between 3 and {len(BED_COLUMNS)} columns, got {n_columns}")
+    return _read(path, BED_COLUMNS[:n_columns], skip, _bed_to_ranges, chunk_size, by_chrom)
+
+
+def read_narrowpeak(path, chunk_size=None, by_chrom=False):
+    """
+    read an ENCODE narrowPeak (BED6+4) file, see read_bed. The signal value, p value, q value and peak offset are in
+    the annotation.
+    """
+    skip, _ = _header(path)
+    return _read(path, NARROWPEAK_COLUMNS, skip, _bed_to_ranges, chunk_size, by_chrom)
+
+
+def read_gtf(path, attributes=("gene_id", "transcript_id"), features=None, chunk_size=None, by_chrom=False):
+    """
+    read a GTF or GFF3 file into GenomicRanges, coordinates are already 1-based and inclusive. Only the requested
+    attributes are pulled out of the last column with a vectorized regular expression, both the GTF (key "value") and
+    GFF3 (key=value) styles are understood.
+    :param path: path to the file, can be gzipped
+    :param attributes: attribute keys to extract into the annotation, missing keys are None
+    :param features: optional feature type or list of feature types to keep, e.g. "exon"
+    :param chunk_size: if given, return a generator of GenomicRanges with at most this many lines each
+    :param by_chrom: return a generator of (chrom, GenomicRanges) tuples, see read_bed
+    :return: GenomicRanges or a generator, annotation has source, feature, score, frame and the attributes
+    """
+    skip, _ = _header(path)
+    if isinstance(features, str):
+        features = [features]
+    patterns = {key: re.compile(rf'(?:^|;)\s*{re.escape(key)}[ =]"?([^";]*)"?') for key in attributes}
+
+    def to_ranges(df):
+        if features is not None:
+            df = df[df["feature"].isin(features)].copy()
+        for key, pattern in patterns.items():
+            df[key] = df["attributes"].str.extract(pattern, expand=False).astype(object)
+            df[key] = df[key].where(df[key].notna(), None)
+        df = df.drop(columns=["attributes"])
+        df["source"] = df["source"].astype(object)
+        df["feature"] = df["feature"].astype(object)
+        return _frame_to_ranges(df)
+
+    return _read(path, GTF_COLUMNS, skip, to_ranges, chunk_size, by_chrom)
+
+
+def group_by_chrom(chunks):
+    """
+    regroup a stream of GenomicRanges chunks into one GenomicRanges per chromosome. Chromosomes are emitted as soon as
+    the next one starts so memory is bounded by the largest chromosome. In an unsorted file a chromosome that comes
+    back later is emitted again.
+    :return: generator of (chrom, GenomicRanges)
+    """
+    current, parts = None, []
+    for chunk in chunks:
+        # chunks of a filtered read (read_gtf with features) can be empty
+        if len(chunk) == 0:
+            continue
+        chroms = chunk.chroms
+        breaks = np.flatnonzero(chroms[1:] != chroms[:-1]) + 1
+        for lo, hi in zip(np.concatenate([[0], breaks]), np.concatenate([breaks, [len(chunk)]])):
+            chrom = chroms[lo]
+            if chrom != current and len(parts) > 0:
+                yield current, GenomicRanges.concat(parts)
+                parts = []
+            current = chrom
+            parts.append(chunk[int(lo):int(hi)])
+    if len(parts) > 0:
+        yield current, GenomicRanges.concat(parts)
+
+
+def save_ranges(granges, path):
+    """
+    write GenomicRanges to a directory with one .npy file per column and a metadata.json with the chromosome names.
+    The numeric columns can be memory mapped by load_ranges. String fields of the annotation are stored as fixed width
+    unicode so they can be mapped too, annotations with other Python objects (e.g. dicts) are pickled and have to be
+    read into memory.
+    :param granges: GenomicRanges to save
+    :param path: directory to write to, created if it does not exist
+    """
+    os.makedirs(path, exist_ok=True)
+    for name, dtype in RANGES_COLUMNS.items():
+        np.save(os.path.join(path, f"{name}.npy"), np.ascontiguousarray(getattr(granges, name), dtype=dtype))
+
+    annotation = None
+    if granges.annotation is not None:
+        values = _fixed_width(granges.annotation)
+        annotation = "pickle" if values.dtype.hasobject else "npy"
+        np.save(os.path.join(path, "annotation.npy"), values, allow_pickle=annotation == "pickle")
+
+    metadata = {"format": RANGES_FORMAT, "version": RANGES_VERSION, "length": len(granges),
+                "chrom_names": granges.chrom_names.tolist(), "annotation": annotation}
+    with open(os.path.join(path, "metadata.json"), "w") as handle:
+        json.dump(metadata, handle)
+
+
+def load_ranges(path, mmap=True):
+    """
+    load GenomicRanges written by save_ranges. With mmap the columns are memory mapped read only, nothing is read until
+    it is used and processes that load the same files share them through the page cache instead of each holding a
+    private copy.
+    :param path: directory written by save_ranges
+    :param mmap: memory map the columns, if False they are read into memory
+    :return: GenomicRanges
+    """
+    with open(os.path.join(path, "metadata.json")) as handle:
+        metadata = json.load(handle)
+    if metadata.get("format") != RANGES_FORMAT or metadata.get("version") != RANGES_VERSION:
+        raise ValueError(f"{path} is not a GenomicRanges directory written by save_ranges")
+
+    mode = "r" if mmap else None
+    columns = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mode) for name in RANGES_COLUMNS}
+    annotation = None
+    if metadata["annotation"] == "npy":
+        annotation = np.load(os.path.join(path, "annotation.npy"), mmap_mode=mode)
+    elif metadata["annotation"] == "pickle":
+        annotation = np.load(os.path.join(path, "annotation.npy"), allow_pickle=True)
+    return GenomicRanges(columns["chrom_codes"], columns["starts"], columns["ends"], columns["strands"],
+                         annotation=annotation, chrom_names=np.asarray(metadata["chrom_names"], dtype=object),
+                         validate=False)
+
+
+def _fixed_width(values):
+    """
+    convert string object fields (or a string object array) to fixed width unicode so they do not need pickling
+    """
+    if values.dtype.names is None:
+        return _fixed_width_column(values)
+    fields = [_fixed_width_column(values[name]) for name in values.dtype.names]
+    out = np.empty(values.shape[0], dtype=[(name, field.dtype) for name, field in zip(values.dtype.names, fields)])
+    for name, field in zip(values.dtype.names, fields):
+        out[name] = field
+    return out
+
+
+def _fixed_width_column(values):
+    values = np.asarray(values)
+    if values.dtype != object or not all(isinstance(value, str) for value in values.tolist()):
+        return values
+    return values.astype(str)
+
+
+def _read(path, columns, skip, to_ranges, chunk_size, by_chrom):
+    reader = pd.read_csv(path, sep="\t", header=None, names=[name for name, _ in columns],
+                         dtype=dict(columns), usecols=range(len(columns)), skiprows=skip,
+                         chunksize=chunk_size if chunk_size is not None else (1000000 if by_chrom else None))
+    if chunk_size is None and not by_chrom:
+        return to_ranges(reader)
+    chunks = (to_ranges(df) for df in reader)
+    if by_chrom:
+        return group_by_chrom(chunks)
+    return chunks
+
+
+def _bed_to_ranges(df):
+    df["start"] = df["start"] + 1
+    return _frame_to_ranges(df)
+
+
+def _frame_to_ranges(df):
+    rest = [column for column in df.columns if column not in ("chrom", "start", "end", "strand")]
+    annotation = df[rest].to_records(index=False) if len(rest) > 0 else None
+    strand = df["strand"].where(df["strand"].isin(["+", "-"]), "*").to_numpy() if "strand" in df.columns else None
+    chroms = df["chrom"].cat.remove_unused_categories()
+    return GenomicRanges(chroms.cat.codes.to_numpy(), df["start"].to_numpy(), df["end"].to_numpy(), strand,
+                         annotation=annotation, chrom_names=chroms.cat.categories.to_numpy(dtype=object))
+
+
+def _header(path):
+    """
+    number of track/browser/comment lines at the top of the file and the first data line
+    """
+    opener = _open_gzip if str(path).endswith(".gz") else open
+    skip = 0
+    with opener(path) as handle:
+        for line in handle:
+            if line.startswith(HEADER_PREFIXES) or not line.strip():
+                skip += 1
+                continue
+            return skip, line.rstrip("\n")
+    return skip, ""
+
+
+def _open_gzip(path):
+    return gzip.open(path, "rt")
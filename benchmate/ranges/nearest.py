@@ -0,0 +1,91 @@
+import numpy as np
+
+from benchmate.ranges.overlaps import OverlapIndex
+
+# queries and subjects are closed [start, end] intervals with integer group codes (chrom or chrom/strand), only
+# intervals in the same group are compared. All functions return one subject index per query, -1 when there is none.
+
+
+def flanking(q_starts, q_ends, q_groups, s_starts, s_ends, s_groups):
+    """
+    closest non overlapping subject on each side of every query using binary search on per group sorted arrays
+    :return: left, the subject with the largest end before the query start, and right, the subject with the smallest
+        start after the query end, ties go to the lowest subject index
+    """
+    q_starts, q_ends, q_groups = _as_arrays(q_starts, q_ends, q_groups)
+    s_starts, s_ends, s_groups = _as_arrays(s_starts, s_ends, s_groups)
+    left = np.full(q_starts.shape[0], -1, dtype=np.int64)
+    right = np.full(q_starts.shape[0], -1, dtype=np.int64)
+    subject_idx = np.arange(s_starts.shape[0])
+
+    for group in np.unique(s_groups).tolist():
+        queries = np.flatnonzero(q_groups == group)
+        if queries.shape[0] == 0:
+            continue
+        members = subject_idx[s_groups == group]
+
+        by_start = members[np.lexsort((members, s_starts[members]))]
+        pos = np.searchsorted(s_starts[by_start], q_ends[queries], side="right")
+        found = pos < by_start.shape[0]
+        right[queries[found]] = by_start[pos[found]]
+
+        # descending index as the tie breaker so the last of equal ends is the lowest index
+        by_end = members[np.lexsort((-members, s_ends[members]))]
+        pos = np.searchsorted(s_ends[by_end], q_starts[queries], side="left") - 1
+        found = pos >= 0
+        left[queries[found]] = by_end[pos[found]]
+    return left, right
+
+
+def precede(q_starts, q_ends, q_groups, q_strands, s_starts, s_ends, s_groups):
+    """
+    the subject each query precedes, i.e. the closest one downstream of it. Downstream is towards larger
+    coordinates unless the query strand is -1.
+    """
+    left, right = flanking(q_starts, q_ends, q_groups, s_starts, s_ends, s_groups)
+    return np.where(np.asarray(q_strands) < 0, left, right)
+
+
+def follow(q_starts, q_ends, q_groups, q_strands, s_starts, s_ends, s_groups):
+    """
+    the subject each query follows, i.e. the closest one upstream of it
+    """
+    left, right = flanking(q_starts, q_ends, q_groups, s_starts, s_ends, s_groups)
+    return np.where(np.asarray(q_strands) < 0, right, left)
+
+
+def nearest(q_starts, q_ends, q_groups, s_starts, s_ends, s_groups, index=None):
+    """
+    the nearest subject of every query, an overlapping subject if there is one otherwise the closest one on either side
+    :param index: OverlapIndex of the subjects if there is one already, built otherwise
+    :return: subject indices and distances, distance is 0 for overlaps and the start to end difference otherwise, same
+        as Range.distance, both are -1 when the group has no subjects
+    """
+    q_starts, q_ends, q_groups = _as_arrays(q_starts, q_ends, q_groups)
+    s_starts, s_ends, s_groups = _as_arrays(s_starts, s_ends, s_groups)
+    if s_starts.shape[0] == 0:
+        return np.full(q_starts.shape[0], -1, dtype=np.int64), np.full(q_starts.shape[0], -1, dtype=np.int64)
+    left, right = flanking(q_starts, q_ends, q_groups, s_starts, s_ends, s_groups)
+
+    left_distance = np.where(left >= 0, q_starts - s_ends[left], np.iinfo(np.int64).max)
+    right_distance = np.where(right >= 0, s_starts[right] - q_ends, np.iinfo(np.int64).max)
+    use_right = (right_distance < left_distance) | ((right_distance == left_distance) & (right >= 0)
+                                                    & ((left < 0) | (right < left)))
+    hits = np.where(use_right, right, left)
+    distance = np.where(use_right, right_distance, left_distance)
+    distance[hits < 0] = -1
+
+    if index is None:
+        index = OverlapIndex(s_starts, s_ends, s_groups)
+    query_idx, subject_idx = index.query(q_starts, q_ends, q_groups, type="any")
+    # hits are sorted by query then subject, the first hit of each query is its lowest overlapping subject
+    first = np.ones(query_idx.shape[0], dtype=bool)
+    first[1:] = query_idx[1:] != query_idx[:-1]
+    hits[query_idx[first]] = subject_idx[first]
+    distance[query_idx[first]] = 0
+    return hits, distance
+
+
+def _as_arrays(starts, ends, groups):
+    return (np.asarray(starts, dtype=np.int64), np.asarray(ends, dtype=np.int64),
+            np.asarray(groups, dtype=np.int64))
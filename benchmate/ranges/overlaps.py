@@ -0,0 +1,116 @@
+import numpy as np
+
+OVERLAP_TYPES = ["exact", "within", "start", "end", "any"]
+
+
+def check_overlap_type(type):
+    if type not in OVERLAP_TYPES:
+        raise ValueError(f"overlap_type must be one of {OVERLAP_TYPES}")
+
+
+class OverlapIndex:
+    def __init__(self, starts, ends, groups=None):
+        """
+        Sorted index over closed [start, end] intervals for repeated overlap queries. Intervals are bucketed by an
+        integer group code (chrom/strand) and sorted by start within each bucket. Alongside the starts we keep a running
+        maximum of the ends and the largest width so that every query is two binary searches plus a scan over its hits,
+        O(log N + k) instead of comparing against every interval.
+        :param starts: interval starts
+        :param ends: interval ends
+        :param groups: integer group code for each interval, None puts everything in one group
+        """
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        if starts.shape != ends.shape:
+            raise ValueError("starts and ends must have the same length")
+        if groups is None:
+            groups = np.zeros(starts.shape[0], dtype=np.int64)
+        else:
+            groups = np.asarray(groups, dtype=np.int64)
+
+        # order maps positions in the sorted arrays back to the original indices
+        self.order = np.lexsort((starts, groups))
+        self.starts = starts[self.order]
+        self.ends = ends[self.order]
+        sorted_groups = groups[self.order]
+
+        keys, offsets = np.unique(sorted_groups, return_index=True)
+        bounds = np.append(offsets, sorted_groups.shape[0])
+        self.groups = {}
+        self.max_ends = np.empty_like(self.ends)
+        self.max_widths = {}
+        for key, lo, hi in zip(keys.tolist(), bounds[:-1].tolist(), bounds[1:].tolist()):
+            self.groups[key] = (lo, hi)
+            self.max_ends[lo:hi] = np.maximum.accumulate(self.ends[lo:hi])
+            self.max_widths[key] = int((self.ends[lo:hi] - self.starts[lo:hi]).max()) + 1
+
+    def query(self, starts, ends, groups=None, type="any"):
+        """
+        find all the indexed intervals overlapping the query intervals, overlap types follow Range.overlaps with the
+        query as self and the indexed interval as other
+        :param starts: query starts
+        :param ends: query ends
+        :param groups: group codes of the queries, must use the same encoding as the index
+        :param type: one of exact, within, start, end or any
+        :return: two int64 arrays, query indices and indexed (subject) indices, sorted by query then subject
+        """
+        check_overlap_type(type)
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        if groups is None:
+            groups = np.zeros(starts.shape[0], dtype=np.int64)
+        else:
+            groups = np.asarray(groups, dtype=np.int64)
+
+        query_hits = []
+        subject_hits = []
+        for key, (lo, hi) in self.groups.items():
+            query_idx = np.flatnonzero(groups == key)
+            if query_idx.shape[0] == 0:
+                continue
+            q, s = self._query_group(starts[query_idx], ends[query_idx], lo, hi, self.max_widths[key], type)
+            query_hits.append(query_idx[q])
+            subject_hits.append(s)
+
+        if len(query_hits) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+        query_hits = np.concatenate(query_hits)
+        subject_hits = self.order[np.concatenate(subject_hits)]
+        order = np.lexsort((subject_hits, query_hits))
+        return query_hits[order], subject_hits[order]
+
+    def _query_group(self, q_starts, q_ends, lo, hi, max_width, type):
+        starts = self.starts[lo:hi]
+        ends = self.ends[lo:hi]
+
+        if type == "exact":
+            first = np.searchsorted(starts, q_starts, side="left")
+            last = np.searchsorted(starts, q_starts, side="right")
+        else:
+            # anything at or past last starts after the query ends, anything before first ends before it starts
+            last = np.searchsorted(starts, q_ends, side="right")
+            first = np.maximum(np.searchsorted(self.max_ends[lo:hi], q_starts, side="left"),
+                               np.searchsorted(starts, q_starts - max_width + 1, side="left"))
+            if type in ("within", "start"):
+                first = np.maximum(first, np.searchsorted(starts, q_starts, side="left"))
+
+        counts = np.maximum(last - first, 0)
+        total = int(counts.sum())
+        q = np.repeat(np.arange(q_starts.shape[0]), counts)
+        s = np.repeat(first - np.cumsum(counts) + counts, counts) + np.arange(total)
+
+        hit_ends = ends[s]
+        if type == "exact":
+            keep = hit_ends == q_ends[q]
+        elif type == "within":
+            keep = (hit_ends >= q_starts[q]) & (hit_ends <= q_ends[q])
+        elif type == "end":
+            keep = (hit_ends >= q_starts[q]) & (hit_ends <= q_ends[q])
+        else:
+            keep = hit_ends >= q_starts[q]
+
+        return q[keep], s[keep] + lo
+
+    def __len__(self):
+        return self.starts.shape[0]
@@ -0,0 +1,171 @@
+from concurrent.futures import Executor, ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from benchmate.ranges.coverage import coverage
+from benchmate.ranges.overlaps import OverlapIndex
+from benchmate.ranges import setops
+
+# Range operations never compare intervals from different chromosomes (or strands) so they can be run one group at a
+# time. map_groups sorts the input tables by group code, puts the columns in shared memory and sends one task per group
+# to a process pool, workers attach to the shared blocks instead of receiving pickled copies of the data.
+
+
+class SharedArrays:
+    def __init__(self, arrays):
+        """
+        copy numpy arrays into shared memory blocks that worker processes can attach to by name, use as a context
+        manager or call close() so that the blocks are released
+        :param arrays: dictionary of name to numpy array
+        """
+        self.blocks = []
+        self.specs = {}
+        for name, values in arrays.items():
+            values = np.ascontiguousarray(values)
+            block = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+            np.ndarray(values.shape, dtype=values.dtype, buffer=block.buf)[:] = values
+            self.blocks.append(block)
+            self.specs[name] = (block.name, values.shape, values.dtype.str)
+
+    def close(self):
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def is_serial(n_jobs):
+    return not isinstance(n_jobs, Executor) and (n_jobs is None or n_jobs == 1)
+
+
+def get_executor(n_jobs):
+    """
+    :param n_jobs: None or 1 to run in the current process, a number of worker processes or an existing
+        concurrent.futures Executor to reuse between calls
+    :return: the executor and whether it was created here (and needs to be shut down), None for serial execution
+    """
+    if isinstance(n_jobs, Executor):
+        return n_jobs, False
+    if is_serial(n_jobs):
+        return None, False
+    if n_jobs < 1:
+        raise ValueError("n_jobs must be a positive integer or an Executor")
+    return ProcessPoolExecutor(max_workers=n_jobs), True
+
+
+def map_groups(func, tables, n_jobs=None):
+    """
+    run func once per group code and collect the results in group order so the output does not depend on scheduling
+    :param func: picklable callable, called as func(key, *tables) where every table is a dictionary of the columns
+        restricted to the group, an "index" column holds the original row numbers
+    :param tables: list of (groups, columns) tuples, groups is an array of group codes and columns a dictionary of
+        arrays aligned with it
+    :param n_jobs: see get_executor
+    :return: list of (key, result) sorted by key
+    """
+    sorted_tables = []
+    keys = set()
+    for groups, columns in tables:
+        groups = np.asarray(groups, dtype=np.int64)
+        order = np.argsort(groups, kind="stable")
+        sorted_groups = groups[order]
+        columns = {name: np.asarray(values)[order] for name, values in columns.items()}
+        columns["index"] = order
+        sorted_tables.append((sorted_groups, columns))
+        keys.update(np.unique(sorted_groups).tolist())
+    keys = sorted(keys)
+
+    bounds = {}
+    for key in keys:
+        bounds[key] = [(int(np.searchsorted(groups, key, side="left")),
+                        int(np.searchsorted(groups, key, side="right"))) for groups, _ in sorted_tables]
+
+    executor, owned = get_executor(n_jobs)
+    if executor is None:
+        return [(key, func(key, *[{name: values[lo:hi] for name, values in columns.items()}
+                                  for (lo, hi), (_, columns) in zip(bounds[key], sorted_tables)]))
+                for key in keys]
+
+    shared = [SharedArrays(columns) for _, columns in sorted_tables]
+    try:
+        futures = [(key, executor.submit(_run_group, func, key, [table.specs for table in shared], bounds[key]))
+                   for key in keys]
+        return [(key, future.result()) for key, future in futures]
+    finally:
+        for table in shared:
+            table.close()
+        if owned:
+            executor.shutdown()
+
+
+def _run_group(func, key, specs, bounds):
+    blocks, tables, table = [], [], None
+    try:
+        for table_specs, (lo, hi) in zip(specs, bounds):
+            table = {}
+            for name, (block_name, shape, dtype) in table_specs.items():
+                block = _attach(block_name)
+                blocks.append(block)
+                table[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)[lo:hi]
+            tables.append(table)
+        result = func(key, *tables)
+        # results must not point into the shared blocks, they are closed below
+        if isinstance(result, tuple):
+            return tuple(np.array(value) if isinstance(value, np.ndarray) else value for value in result)
+        return result
+    finally:
+        # drop our views before closing, numpy arrays keep the shared buffers exported
+        tables = table = None
+        for block in blocks:
+            block.close()
+
+
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # track is new in python 3.13, before that workers register the block with the resource tracker they share
+        # with the parent, which is harmless since the parent unlinks it
+        return shared_memory.SharedMemory(name=name)
+
+
+def overlaps_task(key, query, subject, type="any"):
+    """
+    overlaps of one group, returns original query and subject indices
+    """
+    index = OverlapIndex(subject["starts"], subject["ends"])
+    query_idx, subject_idx = index.query(query["starts"], query["ends"], type=type)
+    return query["index"][query_idx], subject["index"][subject_idx]
+
+
+def coverage_task(key, table, bounds=None, rle=False):
+    """
+    coverage of one group, bounds is an optional dictionary of group code to (min_pos, max_pos)
+    """
+    min_pos, max_pos = (None, None) if bounds is None else bounds[key]
+    return coverage(table["starts"], table["ends"], min_pos, max_pos, weights=table.get("weights"), rle=rle)
+
+
+def merge_task(key, table, gap=0):
+    return setops.merge(table["starts"], table["ends"], np.full(table["starts"].shape[0], key), gap=gap)
+
+
+def setop_task(key, first, second, op="union"):
+    return getattr(setops, op)(first["starts"], first["ends"], np.full(first["starts"].shape[0], key),
+                               second["starts"], second["ends"], np.full(second["starts"].shape[0], key))
+
+
+def concat_results(results):
+    """
+    concatenate the per group (groups, starts, ends) results of merge_task or setop_task
+    """
+    if len(results) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return tuple(np.concatenate([result[i] for _, result in results]) for i in range(3))
@@ -1,54 +1,54 @@
+from collections import Counter
 
-import pandas as pd
-from math import floor
+from benchmate.ranges.overlaps import OverlapIndex, check_overlap_type
+from benchmate.ranges.coverage import coverage
 
 
 class Range:
+    # no per instance __dict__ and no pandas.Interval, overlaps are plain integer comparisons
+    __slots__ = ("start", "end")
+
     def __init__(self, start, end):
         self._check_values(start, end)
         self.start = start
         self.end = end
-        self._range = pd.Interval(self.start, self.end, closed='both')
 
     def shift(self, amount=0):
         new_start = self.start + amount
         new_end = self.end + amount
         self._check_values(new_start, new_end)
-        self.start += amount
-        self.end += amount
+        self.start = new_start
+        self.end = new_end
         return self
 
     def extend(self, start=0, end=0):
         new_start = self.start + start
         new_end = self.end + end
         self._check_values(new_start, new_end)
-        self.start += start
-        self.end += end
-        self._range = pd.Interval(new_start, new_end, closed='both')
+        self.start = new_start
+        self.end = new_end
         return self
 
     def overlaps(self, other, type="exact"):
         assert(isinstance(other, Range))
-        overlap_types=["exact", "within", "start", "end", "any"]
-        if type not in overlap_types:
-            raise ValueError(f"overlap_type must be one of {overlap_types}")
+        check_overlap_type(type)
 
+        # closed intervals, touching ends count as an overlap
+        overlap = self.start <= other.end and other.start <= self.end
         if type == "exact":
-            return self==other
+            return self == other
         elif type == "any":
-            return self._range.overlaps(other._range)
+            return overlap
         elif type == "within":
-            return self._range.overlaps(other._range) and self.start <= other.start and self.end >= other.end
+            return overlap and self.start <= other.start and self.end >= other.end
         elif type == "start":
-            return self._range.overlaps(other._range) and self.start <= other.start
-        elif type == "end":
-            return self._range.overlaps(other._range) and self.end >= other.end
+            return overlap and self.start <= other.start
         else:
-            return None
+            return overlap and self.end >= other.end
 
     def distance(self, other):
         assert(isinstance(other, Range))
-        if self.overlaps(other):
+        if self.overlaps(other, type="any"):
             return 0
         else:
             return min(abs(self.start - other.start), abs(self.end - other.end),
@@ -62,12 +62,9 @@ class Range:
         """
         assert(isinstance(n, int))
         assert(n > 0)
-        step = floor(self.end - self.start) / n
-        ranges = []
-        for i in range(n):
-            start = self.start + i * step
-            end = self.start + (i + 1) * step
-            ranges.append(Range(start, end))
+        # integer boundaries, the last part absorbs the remainder
+        bounds = [self.start + (i * (self.end - self.start)) // n for i in range(n + 1)]
+        ranges = [Range(bounds[i], bounds[i + 1]) for i in range(n)]
         ranges=RangesList(ranges)
         return ranges
 
@@ -88,10 +85,13 @@ class Range:
 
 
     def __eq__(self, other):
-        if self.start == other.start and self.end == other.end:
-            return True
-        else:
-            return False
+        if not isinstance(other, Range):
+            return NotImplemented
+        return self.start == other.start and self.end == other.end
+
+    def __hash__(self):
+        # ranges are mutable, do not shift or extend a range while it is in a set or used as a dictionary key
+        return hash((self.start, self.end))
 
     def __len__(self):
         return abs(self.end - self.start)
@@ -106,60 +106,60 @@ class RangesList:
         for item in granges:
             assert (isinstance(item, Range))
         self.items = granges
+        self._index = None
 
     def pop(self, index):
         assert(isinstance(index, int))
+        self._index = None
         return self.items.pop(index)
 
     def insert(self, index, value):
         assert(isinstance(index, int))
         assert(isinstance(value, Range))
         self.items.insert(index, value)
+        self._index = None
 
     def append(self, item):
         assert(isinstance(item, Range))
         self.items.append(item)
+        self._index = None
 
     def extend(self, other):
         assert(isinstance(other, RangesList))
         self.items.extend(other.items)
+        self._index = None
 
     def remove(self, item):
         assert(isinstance(item, Range))
         self.items.remove(item)
+        self._index = None
 
     def find_overlaps(self, other=None, type="exact", return_ranges=True):
+        """
+        find overlapping pairs between this list (query) and other (subject) using a sorted OverlapIndex on the subject
+        :param other: another RangesList, if None overlaps are searched within this list
+        :param type: one of exact, within, start, end or any, see Range.overlaps
+        :param return_ranges: return (query, subject) Range tuples, if False returns (i, j) index tuples
+        :return: list of tuples sorted by query then subject index
+        """
         if other is None:
             other = self
         assert(isinstance(other, RangesList))
-        overlaps = []
-        for i in range(len(self)):
-            for j in range(len(other)):
-                overlap=self.items[i].overlaps(other.items[j], type=type)
-                if overlap is not None:
-                    if return_ranges:
-                        overlaps.append((self.items[i], other.items[j]))
-                    else:
-                        overlaps.append((i, j))
-        return overlaps
-
-    def coverage(self):
-
-        min_pos = min(r.start for r in self.items)
-        max_pos = max(r.end for r in self.items)
-        length = max_pos - min_pos + 1
-        coverage = [0] * length
-
-        # Count coverage for each range
-        for range_obj in self.items:
-            # Adjust positions relative to min_pos
-            start_idx = range_obj.start - min_pos
-            end_idx = range_obj.end - min_pos + 1
-            # Increment coverage count for all positions in this range
-            for i in range(start_idx, end_idx):
-                coverage[i] += 1
-
-        return coverage
+        check_overlap_type(type)
+        index = OverlapIndex([item.start for item in other.items], [item.end for item in other.items])
+        query_idx, subject_idx = index.query([item.start for item in self.items],
+                                             [item.end for item in self.items], type=type)
+        if return_ranges:
+            return [(self.items[i], other.items[j]) for i, j in zip(query_idx.tolist(), subject_idx.tolist())]
+        return list(zip(query_idx.tolist(), subject_idx.tolist()))
+
+    def coverage(self, rle=False):
+        """
+        number of ranges covering each position from min(start) to max(end)
+        :param rle: return a run-length encoded Rle instead of a dense array
+        :return: numpy array of coverage depths or an Rle
+        """
+        return coverage([item.start for item in self.items], [item.end for item in self.items], rle=rle)
 
     def __getitem__(self, item):
         if isinstance(item, int):
@@ -180,11 +180,12 @@ class RangesList:
 
     def __sub__(self, other):
         assert (isinstance(other, RangesList))
-        return RangesList([item for item in self.items if item not in other.items])
+        index = other._counts()
+        return RangesList([item for item in self.items if item not in index])
 
     def __contains__(self, item):
-        assert (isinstance(item, RangesList))
-        return item in self.items
+        assert (isinstance(item, Range))
+        return item in self._counts()
 
     def __str__(self):
         return f"RangesList({self.items})"
@@ -196,19 +197,33 @@ class RangesList:
         assert (isinstance(index, int))
         assert (isinstance(value, Range))
         self.items[index] = value
+        self._index = None
 
     def __delitem__(self, index):
         assert (isinstance(index, int))
         del self.items[index]
+        self._index = None
 
     def __eq__(self, other):
         assert (isinstance(other, RangesList))
-        if len(self.items) != len(other.items):
-            return False
-        for item in self.items:
-            if item not in other.items:
-                return False
-        return True
+        # same ranges with the same number of copies, order does not matter
+        return len(self.items) == len(other.items) and self._counts() == other._counts()
+
+    def unique(self):
+        """
+        the first copy of every range in the order they appear in the list
+        :return: a new RangesList
+        """
+        return RangesList(list(dict.fromkeys(self.items)))
+
+    def _counts(self):
+        """
+        hash index of the items, range to number of copies. It is built on first use and dropped when the list is
+        changed through its methods, ranges that are shifted or extended in place after that are not seen by it.
+        """
+        if self._index is None:
+            self._index = Counter(self.items)
+        return self._index
 
     def __ne__(self, other):
         if not isinstance(other, RangesList):
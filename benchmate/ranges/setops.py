@@ -0,0 +1,144 @@
+import numpy as np
+
+# all the functions here work on closed [start, end] intervals with an integer group code (chrom or chrom/strand), they
+# return new (groups, starts, ends) arrays sorted by group and start
+
+
+def merge(starts, ends, groups, gap=0):
+    """
+    merge overlapping intervals within each group
+    :param starts: interval starts
+    :param ends: interval ends
+    :param groups: group codes
+    :param gap: intervals separated by at most this many uncovered bases are merged as well, with 0 overlapping and
+        book-ended intervals are merged
+    :return: groups, starts, ends of the merged intervals
+    """
+    starts, ends, groups = _as_arrays(starts, ends, groups)
+    if starts.shape[0] == 0:
+        return groups, starts, ends
+    order = np.lexsort((starts, groups))
+    starts, ends, groups = starts[order], ends[order], groups[order]
+
+    new_group = np.concatenate([[True], groups[1:] != groups[:-1]])
+    # running max of ends that restarts with each group, offsetting each group above the previous one keeps a single
+    # accumulate from leaking across groups
+    offset = (np.cumsum(new_group) - 1) * (int(ends.max()) - int(starts.min()) + gap + 2)
+    running_end = np.maximum.accumulate(ends + offset) - offset
+
+    new_cluster = new_group.copy()
+    new_cluster[1:] |= starts[1:] > running_end[:-1] + gap + 1
+    first = np.flatnonzero(new_cluster)
+    return groups[first], starts[first], np.maximum.reduceat(ends, first)
+
+
+def disjoin(starts, ends, groups):
+    """
+    split the intervals at every start and end so that the result does not overlap and every piece is covered by the
+    same set of input intervals
+    :return: groups, starts, ends of the pieces
+    """
+    starts, ends, groups = _as_arrays(starts, ends, groups)
+    breaks_groups, breaks, depth = _sweep(groups, [(starts, ends)])
+    return _segments(breaks_groups, breaks, depth[0] > 0)
+
+
+def gaps(starts, ends, groups, sizes):
+    """
+    the parts of each group between 1 and its size that are not covered by any interval
+    :param sizes: dictionary of group code to size, groups without intervals are returned whole
+    :return: groups, starts, ends of the gaps
+    """
+    starts, ends, groups = _as_arrays(starts, ends, groups)
+    size_groups = np.fromiter(sizes.keys(), dtype=np.int64, count=len(sizes))
+    size_ends = np.fromiter(sizes.values(), dtype=np.int64, count=len(sizes))
+    whole = (np.ones(size_groups.shape[0], dtype=np.int64), size_ends)
+    breaks_groups, breaks, depth = _sweep(np.concatenate([size_groups, groups]),
+                                          [_pad(whole, 0, starts.shape[0]),
+                                           _pad((starts, ends), size_groups.shape[0], 0)])
+    return _segments(breaks_groups, breaks, (depth[0] > 0) & (depth[1] == 0))
+
+
+def union(starts, ends, groups, other_starts, other_ends, other_groups):
+    """
+    positions covered by either set of intervals
+    """
+    return _combine(starts, ends, groups, other_starts, other_ends, other_groups, np.logical_or)
+
+
+def intersect(starts, ends, groups, other_starts, other_ends, other_groups):
+    """
+    positions covered by both sets of intervals
+    """
+    return _combine(starts, ends, groups, other_starts, other_ends, other_groups, np.logical_and)
+
+
+def setdiff(starts, ends, groups, other_starts, other_ends, other_groups):
+    """
+    positions covered by the first set of intervals but not by the second
+    """
+    return _combine(starts, ends, groups, other_starts, other_ends, other_groups,
+                    lambda first, second: first & ~second)
+
+
+def _combine(starts, ends, groups, other_starts, other_ends, other_groups, op):
+    first = _as_arrays(starts, ends, groups)
+    second = _as_arrays(other_starts, other_ends, other_groups)
+    n_first, n_second = first[0].shape[0], second[0].shape[0]
+    breaks_groups, breaks, depth = _sweep(np.concatenate([first[2], second[2]]),
+                                          [_pad(first[:2], 0, n_second), _pad(second[:2], n_first, 0)])
+    groups, starts, ends = _segments(breaks_groups, breaks, op(depth[0] > 0, depth[1] > 0))
+    # pieces coming from different breakpoints can touch, glue them back together
+    return merge(starts, ends, groups)
+
+
+def _sweep(groups, interval_sets):
+    """
+    depth of each set of intervals after every breakpoint. Every set is a (starts, ends) pair aligned with groups,
+    rows that do not belong to a set have start > end and contribute nothing.
+    :return: group and position of every distinct breakpoint and a (n_sets, n_breaks) array of depths
+    """
+    positions = np.concatenate([np.concatenate([s for s, _ in interval_sets]),
+                                np.concatenate([e + 1 for _, e in interval_sets])])
+    break_groups = np.tile(groups, 2 * len(interval_sets))
+    if positions.shape[0] == 0:
+        return break_groups, positions, np.zeros((len(interval_sets), 0), dtype=np.int64)
+
+    # one delta column per set, +1 at starts and -1 after ends, padded rows are zeroed out
+    n = groups.shape[0]
+    deltas = np.zeros((len(interval_sets), positions.shape[0]), dtype=np.int64)
+    for i, (s, e) in enumerate(interval_sets):
+        valid = (s <= e).astype(np.int64)
+        deltas[i, i * n:(i + 1) * n] = valid
+        deltas[i, (len(interval_sets) + i) * n:(len(interval_sets) + i + 1) * n] = -valid
+
+    order = np.lexsort((positions, break_groups))
+    positions, break_groups, deltas = positions[order], break_groups[order], deltas[:, order]
+    distinct = np.concatenate([[True], (positions[1:] != positions[:-1]) | (break_groups[1:] != break_groups[:-1])])
+    key = np.cumsum(distinct) - 1
+    # every interval opens and closes inside its own group so a single cumulative sum never leaks between groups
+    depth = np.cumsum(np.stack([np.bincount(key, weights=d) for d in deltas]), axis=1).astype(np.int64)
+    return break_groups[distinct], positions[distinct], depth
+
+
+def _segments(break_groups, breaks, keep):
+    """
+    turn the stretch between each breakpoint and the next one into an interval and keep the selected ones
+    """
+    keep = keep[:-1] & (break_groups[1:] == break_groups[:-1]) if breaks.shape[0] > 1 else np.zeros(0, dtype=bool)
+    selected = np.flatnonzero(keep)
+    return break_groups[selected], breaks[selected], breaks[selected + 1] - 1
+
+
+def _pad(interval_set, before, after):
+    """
+    pad a (starts, ends) pair with empty rows so that it lines up with concatenated groups
+    """
+    starts, ends = interval_set
+    return (np.concatenate([np.ones(before, dtype=np.int64), starts, np.ones(after, dtype=np.int64)]),
+            np.concatenate([np.zeros(before, dtype=np.int64), ends, np.zeros(after, dtype=np.int64)]))
+
+
+def _as_arrays(starts, ends, groups):
+    return (np.asarray(starts, dtype=np.int64), np.asarray(ends, dtype=np.int64),
+            np.asarray(groups, dtype=np.int64))
@@ -0,0 +1,62 @@
+import numpy as np
+
+
+def sliding_windows(starts, ends, width, step=None, chunk_size=1000000):
+    """
+    windows of a fixed width sliding along each closed [start, end] interval, the last window of an interval is
+    truncated at its end. With step larger than width the bases between the windows are not covered. The windows are produced in chunks so that tiling a whole genome never needs more than
+    chunk_size windows in memory.
+    :param starts: interval starts
+    :param ends: interval ends
+    :param width: width of each window
+    :param step: distance between window starts, defaults to width which tiles the intervals without overlap
+    :param chunk_size: maximum number of windows per chunk
+    :return: generator of (interval index, window starts, window ends) arrays
+    """
+    if step is None:
+        step = width
+    if width <= 0 or step <= 0 or chunk_size <= 0:
+        raise ValueError("width, step and chunk_size must be positive")
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+
+    # a window is started every step bases until one reaches the end of the interval, with step > width the last
+    # start can fall past the end before any window reaches it so only the starts <= end are counted
+    counts = np.minimum(np.maximum(-(-(ends - starts + 1 - width) // step), 0), (ends - starts) // step) + 1
+    offsets = np.cumsum(counts)
+    total = int(offsets[-1]) if offsets.shape[0] > 0 else 0
+
+    for chunk_start in range(0, total, chunk_size):
+        window = np.arange(chunk_start, min(chunk_start + chunk_size, total))
+        interval = np.searchsorted(offsets, window, side="right")
+        rank = window - (offsets[interval] - counts[interval])
+        window_starts = starts[interval] + rank * step
+        yield interval, window_starts, np.minimum(window_starts + width - 1, ends[interval])
+
+
+def bin_counts(starts, ends, size, width, weights=None):
+    """
+    number of intervals overlapping each bin of a chromosome split into consecutive bins of width bases, the first
+    bin starts at 1. Each interval adds one to a difference array at its first bin and removes it after its last bin
+    so this is a single pass no matter how many bins an interval spans.
+    :param starts: interval starts
+    :param ends: interval ends
+    :param size: chromosome size
+    :param width: bin width
+    :param weights: optional weight per interval, e.g. a score, bins then get the sum of the weights
+    :return: array with one value per bin
+    """
+    if width <= 0:
+        raise ValueError("width must be positive")
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    n_bins = -(-int(size) // width)
+
+    keep = (ends >= 1) & (starts <= size)
+    first_bin = (np.maximum(starts[keep], 1) - 1) // width
+    last_bin = (np.minimum(ends[keep], size) - 1) // width
+    if weights is not None:
+        weights = np.asarray(weights)[keep]
+    diff = (np.bincount(first_bin, weights=weights, minlength=n_bins + 1)
+            - np.bincount(last_bin + 1, weights=weights, minlength=n_bins + 1))
+    return np.cumsum(diff[:n_bins])
@@ -0,0 +1,15 @@
+import json
+
+import pandas as pd
+
+from benchmate.genome.utils import gtf_attributes_json, parse_gtf_attributes
+
+
+def test_attributes_json_matches_parse_gtf_attributes():
+    attributes = pd.Series(['gene_id "g1"; transcript_id "t1"; exon_number 2;',
+                            'gene_id "g2"; gene_name "A\\\\B"',
+                            'gene_id "g3"; note "x;y";',
+                            'gene_id "g4"; flag; gene_name "B";',
+                            ''])
+    for value, annotations in zip(attributes, gtf_attributes_json(attributes)):
+        assert json.loads(annotations) == parse_gtf_attributes(value)
@@ -0,0 +1,34 @@
+import numpy as np
+
+from benchmate.ranges import tiles
+
+
+def naive_windows(start, end, width, step):
+    windows = []
+    for window_start in range(start, end + 1, step):
+        windows.append((window_start, min(window_start + width - 1, end)))
+        if window_start + width - 1 >= end:
+            break
+    return windows
+
+
+def windows(starts, ends, width, step, chunk_size=1000000):
+    found = [[] for _ in starts]
+    for interval, window_starts, window_ends in tiles.sliding_windows(starts, ends, width, step, chunk_size):
+        for i, start, end in zip(interval, window_starts, window_ends):
+            found[i].append((int(start), int(end)))
+    return found
+
+
+def test_step_larger_than_width():
+    assert windows([1], [10], 3, 5) == [[(1, 3), (6, 8)]]
+    assert windows([1], [11], 3, 5) == [[(1, 3), (6, 8), (11, 11)]]
+
+
+def test_matches_naive():
+    rng = np.random.default_rng(0)
+    starts = rng.integers(1, 100, 200)
+    ends = starts + rng.integers(0, 60, 200)
+    for width, step in [(3, 5), (5, 3), (4, 4), (1, 7), (10, 1)]:
+        expected = [naive_windows(int(s), int(e), width, step) for s, e in zip(starts, ends)]
+        assert windows(starts, ends, width, step, chunk_size=17) == expected